@@ -0,0 +1,95 @@
+import os
+import sys
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from .scaling import bench_size, regressions, RUNS, TIME_TOLERANCE
+
+# Scaling benchmark on synthetic puzzles: python -m benchmarks [--sizes 12,100,1000] [--save-baseline]
+
+DEFAULT_SIZES = "12,100,500,1000,5000" # Piece counts
+BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+def print_result(size, r):
+    t = r["timings"]
+    print(f"{size:>6} pieces ({r['image_pixels'] / 1e6:.0f} MP): "
+          f"detect {t['detect']:.3f}s, analyze {t['analyze']:.3f}s, match {t['match']:.3f}s "
+          f"(true sides {t['match_true_sides']:.3f}s, border only {t['match_border_true_sides']:.3f}s, "
+          f"photo true sides {t['match_photo_true_sides']:.3f}s), "
+          f"peak {r['peak_memory'] / 2**20:.0f} MB")
+    print(f"{'':>14}detected {r['detected']}, with sides {r['with_sides']}; "
+          f"photo recall {r['photo']['recall']:.3f} precision {r['photo']['precision']:.3f}; "
+          f"true sides recall {r['true_sides']['recall']:.3f} precision {r['true_sides']['precision']:.3f}; "
+          f"photo true sides recall {r['photo_true_sides']['recall']:.3f} "
+          f"precision {r['photo_true_sides']['precision']:.3f}")
+    for run in RUNS:
+        passes = ", ".join(f"{stage} {n}" for stage, n in r[run]["stage_passes"].items())
+        print(f"{'':>14}{run} pairs kept by stage: {passes}")
+    for run in ("true_sides", "photo_true_sides"):
+        frame = r[run]["frame"]
+        print(f"{'':>14}{run} frame: {frame['correct_links']} of {frame['links']} links correct, "
+              f"{'closed' if frame['closed'] else 'not closed'}")
+
+def main(argv=None):
+    import argparse
+    from jigsaw.matcher import CASCADE
+
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Synthetic puzzle scaling benchmark")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="Comma separated piece counts")
+    parser.add_argument("--piece-size", type=int, default=100, help="Piece side length in pixels")
+    parser.add_argument("--rotation", type=float, default=10.0, help="Largest piece rotation in degrees")
+    parser.add_argument("--noise", type=float, default=4.0, help="Pixel noise standard deviation")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes for analysis and matching")
+    parser.add_argument("--backend", choices=["length", "ann"], default="length", help="Match candidate search")
+    parser.add_argument("--cascade", default=",".join(CASCADE), help="Comma separated match stages, in order")
+    parser.add_argument("-o", "--output", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", default=BASELINE, help="Baseline results to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="Store the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=TIME_TOLERANCE, help="Accepted relative slowdown")
+    args = parser.parse_args(argv)
+
+    options = {
+        "piece_size": args.piece_size,
+        "rotation": args.rotation,
+        "noise": args.noise,
+        "seed": args.seed,
+        "workers": args.workers,
+        "backend": args.backend,
+        "cascade": args.cascade.split(","),
+    }
+    results = {}
+    for size in [int(s) for s in args.sizes.split(",")]:
+        # A fresh process per size, so that peak memory is not carried over from larger sizes
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+            result = pool.submit(bench_size, size, options).result()
+        results[str(size)] = result
+        print_result(size, result)
+
+    report = {"options": options, "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("No baseline to compare against (store one with --save-baseline).")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline["options"] != options:
+        print("Baseline was recorded with other options, not comparing.")
+        return 0
+    found = regressions(results, baseline["results"], args.tolerance)
+    for line in found:
+        print("REGRESSION: " + line)
+    if not found:
+        print("No regressions against the baseline.")
+    return 1 if found else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,146 @@
+import sys
+import math
+import time
+
+# Scaling benchmark on synthetic puzzles, run with python -m benchmarks.
+# Kept out of __main__ so that the per-size worker processes can import it.
+
+TIME_TOLERANCE = 0.25 # A stage is a regression when it is this much slower than the baseline...
+TIME_SLACK = 0.05 # ...and also slower by more than this many seconds (timer noise on small runs)
+MEMORY_TOLERANCE = 0.25 # Same for the peak memory
+QUALITY_TOLERANCE = 0.02 # Largest accepted drop in recall or precision
+RUNS = ("photo", "true_sides", "photo_true_sides") # Match quality results of each size
+
+def grid_for(n):
+    """Rows and columns of the most square grid with at least n pieces."""
+    rows = max(1, int(math.sqrt(n)))
+    return rows, math.ceil(n / rows)
+
+def peak_memory():
+    """Peak resident memory of this process in bytes."""
+    try:
+        import resource
+    except ImportError: # Windows
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD)] + \
+                       [(name, ctypes.c_size_t) for name in (
+                           "PeakWorkingSetSize", "WorkingSetSize", "QuotaPeakPagedPoolUsage",
+                           "QuotaPagedPoolUsage", "QuotaPeakNonPagedPoolUsage", "QuotaNonPagedPoolUsage",
+                           "PagefileUsage", "PeakPagefileUsage")]
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(),
+                                                 ctypes.byref(counters), counters.cb)
+        return counters.PeakWorkingSetSize
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024 # kB on Linux
+
+def stage_passes():
+    """Pairs kept by each match stage since the metrics were last reset: {stage: passes}."""
+    from jigsaw.metrics import METRICS
+    counters = METRICS.snapshot()["counters"]
+    return {name[:-len("_filter_passes")]: n for name, n in counters.items() if name.endswith("_filter_passes")}
+
+def bench_size(n, options):
+    """
+    Runs one puzzle size and returns its measurements. Meant to run in a fresh process so
+    that the peak memory is that of this size only.
+    """
+    from jigsaw.processor import find_piece_contours, pieces_from_contours, analyze_pieces
+    from jigsaw.matcher import find_matches
+    from jigsaw.border import BorderIndex, find_border_matches, assemble_frame
+    from jigsaw.metrics import METRICS
+    from .synthetic import Puzzle, render_puzzle, make_pieces, photo_pieces, locate_pieces, score_matches, score_frame
+
+    cascade = tuple(options["cascade"])
+    rows, cols = grid_for(n)
+    puzzle = Puzzle(rows, cols, seed=options["seed"])
+    img, placements = render_puzzle(puzzle, piece_size=options["piece_size"], rotation=options["rotation"],
+                                    noise=options["noise"], seed=options["seed"])
+    timings = {}
+
+    t = time.perf_counter()
+    contours, _ = find_piece_contours(img)
+    pieces = pieces_from_contours(img, contours)
+    timings["detect"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    analyze_pieces(pieces, workers=options["workers"])
+    timings["analyze"] = time.perf_counter() - t
+
+    METRICS.reset()
+    t = time.perf_counter()
+    matches = find_matches(pieces, workers=options["workers"], backend=options["backend"], cascade=cascade)
+    timings["match"] = time.perf_counter() - t
+    photo_passes = stage_passes()
+    located = locate_pieces(pieces, placements, options["piece_size"])
+    photo = score_matches(puzzle, located, matches)
+
+    # Matching alone, on pieces with the true corners and side types
+    true_pieces, true_located = make_pieces(puzzle, piece_size=options["piece_size"], seed=options["seed"])
+    METRICS.reset()
+    t = time.perf_counter()
+    true_matches = find_matches(true_pieces, workers=options["workers"], backend=options["backend"], cascade=cascade)
+    timings["match_true_sides"] = time.perf_counter() - t
+    truth = score_matches(puzzle, true_located, true_matches)
+    photo["stage_passes"] = photo_passes
+    truth["stage_passes"] = stage_passes()
+
+    # First phase of the border-first search alone
+    index = BorderIndex(true_pieces)
+    t = time.perf_counter()
+    border_matches = find_border_matches(true_pieces, cascade, index)
+    timings["match_border_true_sides"] = time.perf_counter() - t
+    truth["border_precision"] = score_matches(puzzle, true_located, border_matches)["precision"]
+    truth["frame"] = score_frame(true_located, assemble_frame(true_pieces, border_matches, index))
+
+    # Matching alone on the photo, with the true outlines: as true_sides, but with colour
+    cut_pieces, cut_located = photo_pieces(puzzle, img, placements, piece_size=options["piece_size"])
+    METRICS.reset()
+    t = time.perf_counter()
+    cut_matches = find_matches(cut_pieces, workers=options["workers"], backend=options["backend"], cascade=cascade)
+    timings["match_photo_true_sides"] = time.perf_counter() - t
+    cut = score_matches(puzzle, cut_located, cut_matches)
+    cut["stage_passes"] = stage_passes()
+    index = BorderIndex(cut_pieces)
+    cut["frame"] = score_frame(cut_located, assemble_frame(cut_pieces, find_border_matches(cut_pieces, cascade, index),
+                                                           index))
+
+    return {
+        "pieces": len(puzzle),
+        "image_pixels": img.shape[0] * img.shape[1],
+        "detected": len(pieces),
+        "with_sides": sum(piece.corners is not None for piece in pieces),
+        "timings": timings,
+        "throughput": {stage: len(puzzle) / t if t > 0 else None for stage, t in timings.items()}, # Pieces/s
+        "peak_memory": peak_memory(),
+        "photo": photo, # End to end: detection, analysis and matching
+        "true_sides": truth, # Matching only
+        "photo_true_sides": cut, # Matching only, with the photo's colours
+    }
+
+def regressions(results, baseline, time_tolerance=TIME_TOLERANCE):
+    """Human readable list of what got worse compared to baseline results, for the sizes in both."""
+    found = []
+    for size, result in results.items():
+        base = baseline.get(size)
+        if base is None:
+            continue
+        for stage, t in result["timings"].items():
+            b = base["timings"].get(stage)
+            if b is not None and t > b * (1 + time_tolerance) and t - b > TIME_SLACK:
+                found.append(f"{size} pieces: {stage} took {t:.3f}s, baseline {b:.3f}s")
+        if result["peak_memory"] > base["peak_memory"] * (1 + MEMORY_TOLERANCE):
+            found.append(f"{size} pieces: peak memory {result['peak_memory'] / 2**20:.0f} MB, "
+                         f"baseline {base['peak_memory'] / 2**20:.0f} MB")
+        for run in RUNS:
+            if run not in base:
+                continue
+            for metric in ("recall", "precision"):
+                value, b = result[run][metric], base[run][metric]
+                if value < b - QUALITY_TOLERANCE:
+                    found.append(f"{size} pieces: {run} {metric} {value:.3f}, baseline {b:.3f}")
+    return found
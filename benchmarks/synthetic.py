@@ -0,0 +1,272 @@
+import numpy as np
+import cv2
+
+# Procedural puzzle photos with known solutions, for benchmarks.
+# Piece coordinates are in side lengths: piece (r, c) spans [c, c+1] x [r, r+1] before placement.
+
+SIDE_DIRECTIONS = [(0, -1), (1, 0), (0, 1), (-1, 0)] # Outward (x, y) of sides 0-3: top, right, bottom, left
+KNOB_DEPTH = 0.165 # Distance of a knob tip from the side, in side lengths
+KNOB_POINTS = 24 # Points along the round head of a knob
+PICTURE_DETAIL = 3 # Random colours per side length of the picture printed on the puzzle
+
+class Puzzle:
+    """
+    A rows x cols jigsaw. Interior edges have a knob that bulges to one side at random.
+
+    h_edges[r][c] is the curve between pieces (r, c) and (r+1, c), left to right.
+    v_edges[r][c] is the curve between pieces (r, c) and (r, c+1), top to bottom.
+    h_signs / v_signs are +1 where the knob bulges down / right, -1 where it bulges up / left.
+    """
+    def __init__(self, rows, cols, seed=0, knob_depth=KNOB_DEPTH):
+        self.rows = rows
+        self.cols = cols
+        rng = np.random.default_rng(seed)
+        self.h_signs = rng.choice([-1, 1], size=(rows - 1, cols))
+        self.v_signs = rng.choice([-1, 1], size=(rows, cols - 1))
+        self.h_edges = [[knob_curve((c, r + 1), (c + 1, r + 1), -self.h_signs[r, c], rng, knob_depth)
+                         for c in range(cols)] for r in range(rows - 1)]
+        self.v_edges = [[knob_curve((c + 1, r), (c + 1, r + 1), self.v_signs[r, c], rng, knob_depth)
+                         for c in range(cols - 1)] for r in range(rows)]
+
+    def __len__(self):
+        return self.rows * self.cols
+
+    def cells(self):
+        return [(r, c) for r in range(self.rows) for c in range(self.cols)]
+
+    def polygon(self, r, c):
+        """
+        Outline of piece (r, c), clockwise on screen (y down) from its top-left corner.
+        Returns (points, corner_indices) with the indices of the TL, TR, BR and BL corners.
+        """
+        parts = [
+            self.h_edges[r - 1][c] if r > 0 else np.array([(c, r)], float),
+            self.v_edges[r][c] if c < self.cols - 1 else np.array([(c + 1, r)], float),
+            self.h_edges[r][c][::-1] if r < self.rows - 1 else np.array([(c + 1, r + 1)], float),
+            self.v_edges[r][c - 1][::-1] if c > 0 else np.array([(c, r + 1)], float),
+        ]
+        # Each edge curve ends on the next corner, which the next part starts with
+        parts = [p if len(p) == 1 else p[:-1] for p in parts]
+        corners = np.cumsum([0] + [len(p) for p in parts[:-1]])
+        return np.concatenate(parts), corners
+
+    def side_types(self, r, c):
+        """SideType values of the top, right, bottom and left sides of piece (r, c)."""
+        from jigsaw.piece import SideType
+        def knob(sign): # +1 when the knob bulges out of the piece
+            return SideType.TAB.value if sign > 0 else SideType.SOCKET.value
+        return [
+            knob(-self.h_signs[r - 1, c]) if r > 0 else SideType.FLAT.value,
+            knob(self.v_signs[r, c]) if c < self.cols - 1 else SideType.FLAT.value,
+            knob(self.h_signs[r, c]) if r < self.rows - 1 else SideType.FLAT.value,
+            knob(-self.v_signs[r, c - 1]) if c > 0 else SideType.FLAT.value,
+        ]
+
+    def adjacency(self):
+        """The true matches: pairs ((r, c, side), (r2, c2, side2)) of mating sides."""
+        pairs = []
+        for r in range(self.rows):
+            for c in range(self.cols):
+                if c < self.cols - 1:
+                    pairs.append(((r, c, 1), (r, c + 1, 3)))
+                if r < self.rows - 1:
+                    pairs.append(((r, c, 2), (r + 1, c, 0)))
+        return pairs
+
+def knob_curve(a, b, sign, rng, depth):
+    """
+    Points from a to b along a side with a round knob whose tip is depth side lengths away,
+    on the left of a->b (as seen on screen, y down) for sign +1 and on the right for -1.
+    """
+    a = np.asarray(a, float)
+    d = np.asarray(b, float) - a
+    normal = np.array([d[1], -d[0]]) * sign
+
+    t0 = rng.uniform(0.45, 0.55) # Knob position along the side
+    radius = rng.uniform(0.08, 0.1)
+    center = depth + rng.uniform(-0.005, 0.005) - radius # Height of the head center
+    undercut = 0.6 # Angle below the head center where the head meets the neck
+    neck = radius * np.cos(undercut) * 0.8 # Half width of the neck at the side
+
+    # Side coordinates: u along a->b, v away from the side towards the knob
+    angles = np.linspace(np.pi + undercut, -undercut, KNOB_POINTS)
+    u = np.concatenate(([0.0, t0 - neck], t0 + radius * np.cos(angles), [t0 + neck, 1.0]))
+    v = np.concatenate(([0.0, 0.0], center + radius * np.sin(angles), [0.0, 0.0]))
+    return a + u[:, None] * d + v[:, None] * normal
+
+class Placement:
+    """Where a piece of a rendered puzzle is in the photo: its center (x, y) and rotation in radians."""
+    def __init__(self, center, angle):
+        self.center = center
+        self.angle = angle
+
+def render_puzzle(puzzle, piece_size=100, gap=None, rotation=10.0, noise=0.0, seed=0):
+    """
+    Photo of the scattered pieces of a puzzle: one piece per grid cell, spaced apart, each
+    rotated by up to +/- rotation degrees, on a dark background with Gaussian pixel noise.
+    The pieces show a smooth random picture, continuous across the cuts as on a real puzzle.
+    Returns (BGR image, {(r, c): Placement}).
+    """
+    rng = np.random.default_rng(seed)
+    gap = piece_size if gap is None else gap
+    cell = piece_size + gap
+    h = puzzle.rows * cell + gap
+    w = puzzle.cols * cell + gap
+    img = np.empty((h, w, 3), np.uint8)
+    img[:] = (30, 60, 30)
+
+    # The picture at PICTURE_DETAIL pixels per side length, bilinearly enlarged as it is drawn
+    picture = rng.integers(120, 255, (puzzle.rows * PICTURE_DETAIL + 1, puzzle.cols * PICTURE_DETAIL + 1, 3),
+                           dtype=np.uint8)
+
+    placements = {}
+    for r, c in puzzle.cells():
+        angle = np.deg2rad(rng.uniform(-rotation, rotation))
+        rot = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+        center = np.array([gap + c * cell + piece_size / 2, gap + r * cell + piece_size / 2])
+        local = (puzzle.polygon(r, c)[0] - (c + 0.5, r + 0.5)) * piece_size
+        poly = np.round(local @ rot.T + center).astype(np.int32)
+        placements[(r, c)] = Placement(center, angle)
+
+        x, y, w, h = cv2.boundingRect(poly)
+        # Photo pixel (x + u, y + v) -> picture pixel: unrotate about the center, scale to the picture
+        k = PICTURE_DETAIL / piece_size
+        offset = rot.T @ ((x, y) - center) * k + np.array((c + 0.5, r + 0.5)) * PICTURE_DETAIL
+        to_picture = np.hstack((rot.T * k, offset[:, None]))
+        texture = cv2.warpAffine(picture, to_picture, (w, h), flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP,
+                                 borderMode=cv2.BORDER_REPLICATE)
+        mask = np.zeros((h, w), np.uint8)
+        cv2.fillPoly(mask, [poly - (x, y)], 255)
+        roi = img[y:y + h, x:x + w]
+        roi[mask > 0] = texture[mask > 0]
+    if noise > 0:
+        # In place, row band by row band, to keep memory down on big photos
+        for y in range(0, h, 1024):
+            band = img[y:y + 1024].astype(np.int16)
+            band += rng.normal(0, noise, band.shape).astype(np.int16)
+            img[y:y + 1024] = np.clip(band, 0, 255)
+    return img, placements
+
+def make_pieces(puzzle, piece_size=100, noise=0.0, seed=0):
+    """
+    Analyzed pieces straight from the puzzle outlines, without a photo: contours rotated at
+    random and jittered by noise pixels, with the true corners and side types. Benchmarks
+    matching on its own. Returns (pieces, located) as for locate_pieces.
+    """
+    from jigsaw.piece import Piece, Side, SideType, SideDescriptor
+    from jigsaw.processor import side_segment
+
+    rng = np.random.default_rng(seed)
+    pieces = []
+    located = {}
+    for k, (r, c) in enumerate(puzzle.cells()):
+        points, corners = puzzle.polygon(r, c)
+        angle = rng.uniform(0, 2 * np.pi)
+        rot = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+        local = (points - (c + 0.5, r + 0.5)) * piece_size @ rot.T + piece_size
+        local += rng.normal(0, noise, local.shape) if noise > 0 else 0
+        cnt = np.round(local).astype(np.int32).reshape(-1, 1, 2)
+
+        origin = (int(rng.integers(0, 100 * piece_size)), int(rng.integers(0, 100 * piece_size)))
+        piece = Piece(k + 1, cnt, None, origin_offset=origin)
+        piece.corners = corners
+        for i, side_type in enumerate(puzzle.side_types(r, c)):
+            segment = side_segment(cnt, corners[i], corners[(i+1)%4])
+            piece.set_side(i, Side(segment, SideType(side_type), SideDescriptor(segment)))
+        pieces.append(piece)
+        located[piece.id] = ((r, c), [0, 1, 2, 3])
+    return pieces, located
+
+def photo_pieces(puzzle, img, placements, piece_size=100):
+    """
+    Analyzed pieces of a render_puzzle photo with the true outlines, corners and side types, as
+    where they were drawn. Unlike make_pieces they have images (views of the photo), so colour
+    is available for matching. Returns (pieces, located) as for locate_pieces.
+    """
+    from jigsaw.piece import Piece, Side, SideType, SideDescriptor, FrameSource
+    from jigsaw.processor import side_segment
+
+    source = FrameSource(img)
+    pieces = []
+    located = {}
+    for k, (r, c) in enumerate(puzzle.cells()):
+        points, corners = puzzle.polygon(r, c)
+        placement = placements[(r, c)]
+        ca, sa = np.cos(placement.angle), np.sin(placement.angle)
+        rot = np.array([[ca, -sa], [sa, ca]])
+        # Same outline render_puzzle filled
+        poly = np.round((points - (c + 0.5, r + 0.5)) * piece_size @ rot.T + placement.center).astype(np.int32)
+        x, y, _, _ = cv2.boundingRect(poly)
+        cnt = (poly - (x, y)).reshape(-1, 1, 2)
+
+        piece = Piece(k + 1, cnt, None, origin_offset=(x, y), source=source)
+        piece.corners = corners
+        for i, side_type in enumerate(puzzle.side_types(r, c)):
+            segment = side_segment(cnt, corners[i], corners[(i+1)%4])
+            piece.set_side(i, Side(segment, SideType(side_type), SideDescriptor(segment)))
+        pieces.append(piece)
+        located[piece.id] = ((r, c), [0, 1, 2, 3])
+    return pieces, located
+
+def locate_pieces(pieces, placements, piece_size):
+    """
+    Cell and side directions of detected pieces: {piece.id: ((r, c), [direction of side 0-3])}.
+    Pieces whose centroid is not within half a piece of a placement are left out.
+    A side's direction is the side (0 top .. 3 left) of the unrotated piece it lies on.
+    """
+    cells = list(placements)
+    centers = np.array([placements[cell].center for cell in cells])
+    located = {}
+    for piece in pieces:
+        origin = np.asarray(piece.origin, float)
+        centroid = piece.contour.reshape(-1, 2).mean(axis=0) + origin
+        dist = np.hypot(*(centers - centroid).T)
+        k = int(np.argmin(dist))
+        if dist[k] > piece_size / 2:
+            continue
+        placement = placements[cells[k]]
+        directions = []
+        for side in piece.sides:
+            if side is None:
+                directions.append(None)
+                continue
+            # Outward direction of the side, rotated back to the unrotated piece
+            out = side.contour.reshape(-1, 2).mean(axis=0) + origin - placement.center
+            ca, sa = np.cos(-placement.angle), np.sin(-placement.angle)
+            out = (ca * out[0] - sa * out[1], sa * out[0] + ca * out[1])
+            directions.append(int(np.argmax([out[0] * dx + out[1] * dy for dx, dy in SIDE_DIRECTIONS])))
+        located[piece.id] = (cells[k], directions)
+    return located
+
+def score_frame(located, frame):
+    """
+    Accuracy of an assemble_frame solution: how many of its links join pieces whose cells are
+    next to each other in the puzzle, and whether it closed the frame.
+    """
+    correct = 0
+    for a, (b, _) in frame.links.items():
+        (ra, ca), _ = located[a.id]
+        (rb, cb), _ = located[b.id]
+        correct += abs(ra - rb) + abs(ca - cb) == 1
+    return {"links": len(frame.links), "correct_links": correct, "closed": frame.closed}
+
+def score_matches(puzzle, located, matches):
+    """
+    Recall and precision of matches (find_matches / iter_matches dicts) against the true
+    adjacency of the puzzle. Each pair of sides counts once, whichever way round it is reported.
+    """
+    truth = {frozenset(pair) for pair in puzzle.adjacency()}
+    reported = set()
+    for m in matches:
+        a, b = located.get(m["p1"].id), located.get(m["p2"].id)
+        if a is None or b is None or a[1][m["s1"]] is None or b[1][m["s2"]] is None:
+            reported.add(frozenset(((m["p1"].id, m["s1"]), (m["p2"].id, m["s2"]), "unlocated")))
+            continue
+        reported.add(frozenset(((*a[0], a[1][m["s1"]]), (*b[0], b[1][m["s2"]]))))
+    found = len(reported & truth)
+    return {
+        "recall": found / len(truth) if truth else 1.0,
+        "precision": found / len(reported) if reported else 1.0,
+        "true_pairs": len(truth),
+        "reported_pairs": len(reported),
+    }
@@ -0,0 +1,32 @@
+import sys
+from . import batch
+
+# Headless entry point: python -m jigsaw run IMAGES... [-o OUTPUT]
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="python -m jigsaw", description="Headless jigsaw piece processing")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Detect and match the pieces of images")
+    run_parser.add_argument("images", nargs="+", help="Image paths or glob patterns")
+    run_parser.add_argument("-o", "--output", default="jigsaw_output", help="Output directory")
+    run_parser.add_argument("-f", "--format", choices=sorted(batch.SAVERS), default="json", help="Output file format")
+    run_parser.add_argument("-w", "--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    run_parser.add_argument("--min-area", type=int, default=500, help="Smallest piece area in pixels")
+    run_parser.add_argument("--downscale", type=int, default=1, help="Find contours on a downscaled image first")
+    run_parser.add_argument("--backend", choices=["length", "ann"], default="length", help="Match candidate search")
+    run_parser.add_argument("--metrics", help="Append each image's stage timers and counters to this JSON lines file")
+    run_parser.add_argument("--profile", action="store_true", help="Write cProfile stats next to each output file")
+    run_parser.add_argument("--border-first", action="store_true",
+                            help="Match the frame among edge and corner pieces first, then the interior")
+    run_parser.add_argument("--cache", action="store_true",
+                            help="Reuse and store results in the on-disk cache (JIGSAW_CACHE_DIR)")
+
+    args = parser.parse_args(argv)
+    if args.command == "run":
+        return batch.run(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
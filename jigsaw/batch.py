@@ -0,0 +1,229 @@
+import os
+import sys
+import glob
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+# Headless batch processing, used by python -m jigsaw run.
+# Kept out of __main__ so that worker processes can import it on spawn-based platforms (Windows).
+
+def expand_paths(patterns):
+    """Image paths for the given paths and glob patterns, in order and without duplicates."""
+    paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        for path in matches:
+            if path not in paths:
+                paths.append(path)
+    return paths
+
+def output_names(paths, ext):
+    """Output file name per image: its stem, numbered when two images share a stem."""
+    names = []
+    used = set()
+    for path in paths:
+        stem = os.path.splitext(os.path.basename(path))[0]
+        name, i = stem, 1
+        while name in used:
+            name, i = f"{stem}_{i}", i + 1
+        used.add(name)
+        names.append(name + ext)
+    return names
+
+def pieces_to_json(pieces):
+    result = []
+    for piece in pieces:
+        result.append({
+            "id": piece.id,
+            "origin": [int(v) for v in piece.origin],
+            "center": None if piece.center is None else [float(v) for v in piece.center],
+            "corners": None if piece.corners is None else [int(v) for v in piece.corners],
+            "contour": piece.contour.reshape(-1, 2).tolist(),
+            "sides": [None if side is None else {
+                "type": side.type.name,
+                "contour": side.contour.reshape(-1, 2).tolist(),
+            } for side in piece.sides],
+        })
+    return result
+
+def matches_to_json(matches):
+    return [{"p1": m["p1"].id, "s1": m["s1"], "p2": m["p2"].id, "s2": m["s2"], "score": float(m["score"])}
+            for m in matches]
+
+def save_json(path, image_path, shape, pieces, matches):
+    with open(path, "w") as f:
+        json.dump({
+            "image": image_path,
+            "shape": list(shape),
+            "pieces": pieces_to_json(pieces),
+            "matches": matches_to_json(matches),
+        }, f)
+
+def save_npz(path, image_path, shape, pieces, matches):
+    """Saves the PieceStore arrays of the pieces plus one array per match field."""
+    import numpy as np
+    from .piece import PieceStore
+    store = pieces[0].store if pieces and pieces[0].store is not None else PieceStore(pieces)
+    np.savez_compressed(
+        path,
+        image=np.array(image_path),
+        shape=np.array(shape),
+        ids=store.ids,
+        origins=store.origins,
+        centers=store.centers,
+        rotations=store.rotations,
+        side_types=store.side_types,
+        points=store.points.reshape(-1, 2),
+        contour_ranges=store.contour_ranges,
+        side_ranges=store.side_ranges,
+        match_p1=np.array([m["p1"].id for m in matches], dtype=np.int64),
+        match_s1=np.array([m["s1"] for m in matches], dtype=np.int8),
+        match_p2=np.array([m["p2"].id for m in matches], dtype=np.int64),
+        match_s2=np.array([m["s2"] for m in matches], dtype=np.int8),
+        match_score=np.array([m["score"] for m in matches], dtype=np.float64),
+    )
+
+SAVERS = {"json": save_json, "npz": save_npz}
+
+def process_image(image_path, output_path, options):
+    """
+    Detects, analyzes and matches the pieces of one image and writes them to output_path.
+    Runs in a worker process; returns a summary with per-stage timings in seconds and the
+    jigsaw.metrics snapshot of the image.
+    """
+    from . import metrics
+
+    metrics.METRICS.reset()
+    profile = None
+    if options["profile"]:
+        profile = os.path.splitext(output_path)[0] + ".prof"
+    with metrics.profiled(profile):
+        result = _process_image(image_path, output_path, options)
+    result["metrics"] = metrics.METRICS.snapshot()
+    return result
+
+def match_pieces(pieces, options):
+    """Matches of the pieces, frame first and then the interior with options["border_first"]."""
+    from .matcher import find_matches
+    if not options["border_first"]:
+        return find_matches(pieces, backend=options["backend"])
+
+    from .border import BorderIndex, find_border_matches, find_interior_matches
+    index = BorderIndex(pieces)
+    matches = find_border_matches(pieces, index=index)
+    matches += find_interior_matches(pieces, index=index, backend=options["backend"])
+    return sorted(matches, key=lambda m: m["score"])
+
+def _process_image(image_path, output_path, options):
+    from .processor import load_image, detect_pieces
+
+    timings = {}
+    t = time.perf_counter()
+    img = load_image(image_path)
+    timings["load"] = time.perf_counter() - t
+
+    cache = key = cached = None
+    if options["cache"]:
+        from .cache import ResultCache, cache_key
+        from .matcher import match_settings
+        cache = ResultCache()
+        params = {k: options[k] for k in ("min_area", "downscale", "backend", "border_first")}
+        key = cache_key(img, {"pipeline": "batch", **params, **match_settings()})
+        cached = cache.load(key, img)
+
+    if cached is not None:
+        pieces, matches = cached
+        timings["detect"] = timings["match"] = 0.0
+    else:
+        t = time.perf_counter()
+        pieces, _ = detect_pieces(img, min_area=options["min_area"], workers=options["threads"],
+                                  downscale=options["downscale"])
+        timings["detect"] = time.perf_counter() - t
+
+        t = time.perf_counter()
+        matches = match_pieces(pieces, options)
+        timings["match"] = time.perf_counter() - t
+        if cache is not None:
+            cache.store(key, pieces, matches)
+
+    t = time.perf_counter()
+    SAVERS[options["format"]](output_path, image_path, img.shape, pieces, matches)
+    timings["save"] = time.perf_counter() - t
+
+    result = {
+        "image": image_path,
+        "output": output_path,
+        "pieces": len(pieces),
+        "matches": len(matches),
+        "timings": timings,
+    }
+    if options["border_first"]:
+        from .border import BorderIndex, assemble_frame
+        border = BorderIndex(pieces)
+        frame = assemble_frame(pieces, matches, border)
+        result["frame"] = {
+            "corners": [p.id for p in border.corners],
+            "edges": [p.id for p in border.edges],
+            "chains": [[p.id for p in chain] for chain in frame.chains], # Piece ids in frame order
+            "closed": frame.closed,
+        }
+    return result
+
+def run(args):
+    paths = expand_paths(args.images)
+    if not paths:
+        print("No images found.", file=sys.stderr)
+        return 1
+    os.makedirs(args.output, exist_ok=True)
+    outputs = [os.path.join(args.output, name) for name in output_names(paths, "." + args.format)]
+
+    workers = min(args.workers or os.cpu_count() or 1, len(paths))
+    options = {
+        "min_area": args.min_area,
+        "downscale": args.downscale,
+        "backend": args.backend,
+        "format": args.format,
+        "profile": args.profile, # cProfile stats next to each output file
+        "cache": args.cache, # Reuse results from the on-disk cache (jigsaw.cache)
+        "border_first": args.border_first, # Solve the frame first (jigsaw.border)
+        # Images are the unit of parallelism; one thread each unless there is a single worker
+        "threads": None if workers == 1 else 1,
+    }
+
+    sink = None
+    if args.metrics:
+        from .metrics import JsonLinesSink
+        sink = JsonLinesSink(args.metrics)
+
+    results = []
+    failed = 0
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(process_image, path, out, options) for path, out in zip(paths, outputs)]
+        for path, future in zip(paths, futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                failed += 1
+                print(f"{path}: failed: {e}", file=sys.stderr)
+                continue
+            results.append(result)
+            if sink:
+                sink.write(result)
+            t = result["timings"]
+            print(f"{path}: {result['pieces']} pieces, {result['matches']} matches "
+                  f"(load {t['load']:.2f}s, detect {t['detect']:.2f}s, match {t['match']:.2f}s, save {t['save']:.2f}s)")
+            if "frame" in result:
+                frame = result["frame"]
+                print(f"{path}: frame of {len(frame['corners'])} corners and {len(frame['edges'])} edges, "
+                      f"{'closed' if frame['closed'] else 'open'} in {len(frame['chains'])} chains")
+    elapsed = time.perf_counter() - start
+
+    n_pieces = sum(r["pieces"] for r in results)
+    print(f"{len(results)} images, {n_pieces} pieces in {elapsed:.2f}s with {workers} workers: "
+          f"{len(results) / elapsed:.2f} images/s, {n_pieces / elapsed:.1f} pieces/s")
+
+    with open(os.path.join(args.output, "summary.json"), "w") as f:
+        json.dump({"elapsed": elapsed, "workers": workers, "failed": failed, "images": results}, f, indent=2)
+    return 1 if failed else 0
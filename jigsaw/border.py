@@ -0,0 +1,177 @@
+import numpy as np
+from enum import Enum
+from .piece import Piece, SideType
+from .matcher import SideBucket, CASCADE, describe, check_cascade, match_rows, matches_from_rows, find_matches
+from . import metrics
+
+# Border-first search: the frame of a puzzle is solved first, among corner and edge pieces only
+# (about 4 * sqrt(n) of the n pieces), then the interior is matched without the frame sides.
+
+class PieceKind(Enum):
+    INTERIOR = 0 # No flat side
+    EDGE = 1 # One flat side
+    CORNER = 2 # Two adjacent flat sides
+    UNKNOWN = 3 # Not analyzed, or a pattern of flat sides a rectangular puzzle does not have
+
+def flat_sides(piece: Piece):
+    """Indices of the FLAT sides of a piece, or None if the piece has no sides."""
+    if any(side is None for side in piece.sides):
+        return None
+    return [i for i, side in enumerate(piece.sides) if side.type == SideType.FLAT]
+
+def piece_kind(piece: Piece):
+    """
+    Returns (PieceKind, frame_sides). frame_sides are (before, after) for a border piece: the sides
+    just before its first flat side and just after its last one, in contour order. Those are the
+    sides that continue the frame, and the after side of one border piece mates with the before
+    side of the next (whichever way the contours run). None for other pieces.
+    """
+    flats = flat_sides(piece)
+    if flats is None:
+        return PieceKind.UNKNOWN, None
+    if not flats:
+        return PieceKind.INTERIOR, None
+    if len(flats) == 1:
+        f = flats[0]
+        return PieceKind.EDGE, ((f - 1) % 4, (f + 1) % 4)
+    if len(flats) == 2:
+        a, b = flats
+        if b == a + 1:
+            return PieceKind.CORNER, ((a - 1) % 4, (b + 1) % 4)
+        if (a, b) == (0, 3): # Wraps around: sides 3 then 0
+            return PieceKind.CORNER, (2, 1)
+    return PieceKind.UNKNOWN, None
+
+class BorderIndex:
+    """Pieces of a piece set partitioned by their flat sides: corners, edges, interior and unknown."""
+    def __init__(self, pieces: list[Piece]):
+        self.pieces = pieces
+        self.kinds = {kind: [] for kind in PieceKind} # PieceKind -> [piece_idx, ...]
+        self.frame_sides = {} # piece_idx -> (before, after) side indices, border pieces only
+        for i, piece in enumerate(pieces):
+            kind, sides = piece_kind(piece)
+            self.kinds[kind].append(i)
+            if sides is not None:
+                self.frame_sides[i] = sides
+
+    @property
+    def corners(self):
+        return [self.pieces[i] for i in self.kinds[PieceKind.CORNER]]
+
+    @property
+    def edges(self):
+        return [self.pieces[i] for i in self.kinds[PieceKind.EDGE]]
+
+    @property
+    def interior(self):
+        return [self.pieces[i] for i in self.kinds[PieceKind.INTERIOR]]
+
+    def frame_side_set(self):
+        """All frame sides as a set of (piece, side_idx), e.g. to skip them when matching the interior."""
+        return {(self.pieces[i], s) for i, sides in self.frame_sides.items() for s in sides}
+
+def find_border_matches(pieces: list[Piece], cascade=CASCADE, index=None):
+    """
+    First phase of the border-first search. Matches only the frame sides of the border pieces:
+    the after side of each against the before sides of the others (see piece_kind), with the
+    same candidate search and stages as find_matches, and returns matches in the same form.
+
+    :param cascade: Names of the matcher STAGES candidate pairs go through, in order
+    :param index: A BorderIndex of pieces, if one has already been built
+    """
+    check_cascade(cascade)
+    index = index or BorderIndex(pieces)
+    with metrics.timer("match_border"):
+        entries = {(side_type, end): [] for side_type in (SideType.TAB, SideType.SOCKET) for end in (0, 1)}
+        for i, sides in index.frame_sides.items():
+            piece = pieces[i]
+            for end, s_idx in enumerate(sides): # 0: before, 1: after
+                side = piece.sides[s_idx]
+                if side.type in (SideType.TAB, SideType.SOCKET):
+                    d = describe(side, piece)
+                    entries[(side.type, end)].append((d.length, i, s_idx, d))
+        buckets = {key: SideBucket(e) for key, e in entries.items()}
+        found = np.concatenate((
+            match_rows(buckets[(SideType.TAB, 1)], buckets[(SideType.SOCKET, 0)], cascade=cascade),
+            match_rows(buckets[(SideType.TAB, 0)], buckets[(SideType.SOCKET, 1)], cascade=cascade),
+        ))
+    return matches_from_rows(pieces, found)
+
+def find_interior_matches(pieces: list[Piece], index=None, **kwargs):
+    """
+    Second phase of the border-first search: find_matches without the frame sides, which only
+    mate with each other and were matched by find_border_matches. Takes find_matches' arguments.
+    """
+    index = index or BorderIndex(pieces)
+    skip = index.frame_side_set() | set(kwargs.pop("skip", None) or ())
+    return find_matches(pieces, skip=skip, **kwargs)
+
+class Frame:
+    """
+    A frame solution: links[piece] = (next piece along the frame, score), and the chains of
+    linked pieces in frame order, longest first. closed when one chain holds every border piece
+    and links back from its last piece to its first.
+    """
+    def __init__(self, links, chains, closed, solved_sides):
+        self.links = links
+        self.chains = chains
+        self.closed = closed
+        self.solved_sides = solved_sides # Frame sides with a mate in the solution, {(piece, side_idx)}
+
+def assemble_frame(pieces: list[Piece], border_matches, index=None):
+    """
+    Greedy frame solution from matches sorted by score, e.g. find_border_matches results (other
+    matches are ignored). Links are taken best score first; each border piece gets at most one
+    next and one previous piece, and no loop is closed before it holds every border piece.
+    Returns a Frame.
+    """
+    index = index or BorderIndex(pieces)
+    row = {piece: i for i, piece in enumerate(pieces)}
+    n_border = len(index.frame_sides)
+
+    nxt, prev, links, solved = {}, {}, {}, set()
+    head = {i: i for i in index.frame_sides} # Chain members -> first piece of their chain
+    tail = {i: i for i in index.frame_sides} # Chain first piece -> last piece
+    size = {i: 1 for i in index.frame_sides} # Chain first piece -> length
+    closed = False
+    for m in border_matches: # Sorted by score
+        a, b = row[m["p1"]], row[m["p2"]]
+        sa, sb = m["s1"], m["s2"]
+        if a not in index.frame_sides or b not in index.frame_sides:
+            continue
+        # Orient the link from the piece whose after side matched to the one whose before side did
+        if (sa, sb) == (index.frame_sides[b][1], index.frame_sides[a][0]):
+            a, b, sa, sb = b, a, sb, sa
+        elif (sa, sb) != (index.frame_sides[a][1], index.frame_sides[b][0]):
+            continue
+        if a in nxt or b in prev:
+            continue
+        ha, hb = head[a], head[b]
+        if ha == hb: # Would close a loop
+            if size[ha] < n_border:
+                continue
+            closed = True
+        else:
+            # Append b's chain to a's: a is the tail of its chain and b the head of its own
+            for i in _chain(hb, nxt):
+                head[i] = ha
+            size[ha] += size.pop(hb)
+            tail[ha] = tail.pop(hb)
+        nxt[a], prev[b] = b, a
+        links[pieces[a]] = (pieces[b], m["score"])
+        solved.update(((pieces[a], sa), (pieces[b], sb)))
+        if closed:
+            break
+
+    chains = [[pieces[i] for i in _chain(h, nxt, stop=h)] for h in tail]
+    chains.sort(key=len, reverse=True)
+    return Frame(links, chains, closed, solved)
+
+def _chain(start, nxt, stop=None):
+    # Piece rows of a chain from start, following nxt (until stop, for a closed loop)
+    i = start
+    while True:
+        yield i
+        i = nxt.get(i)
+        if i is None or i == stop:
+            return
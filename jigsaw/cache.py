@@ -0,0 +1,208 @@
+import os
+import json
+import mmap
+import zipfile
+import hashlib
+import numpy as np
+from .piece import Piece, PieceStore, Side, SideType, SideDescriptor, FrameSource, SIGNATURE_POINTS
+from . import metrics
+
+# Content-addressed on-disk cache of detection and matching results.
+# An entry is an uncompressed .npz named by the hash of the image pixels and the parameters,
+# so its arrays can be memory-mapped straight out of the file.
+
+CACHE_VERSION = 3 # Bump when the entry layout or the pipeline output changes
+CACHE_DIR = os.environ.get("JIGSAW_CACHE_DIR") or os.path.join(os.path.expanduser("~"), ".cache", "jigsaw")
+CACHE_MAX_BYTES = int(os.environ.get("JIGSAW_CACHE_BYTES", 1024 * 1024 * 1024)) # Least recently used entries are evicted above this
+
+def cache_key(image, params):
+    """Hex digest of the image pixels (shape, dtype and bytes) and a JSON-able dict of parameters."""
+    h = hashlib.blake2b(digest_size=20)
+    h.update(json.dumps({"version": CACHE_VERSION, "shape": image.shape, "dtype": str(image.dtype),
+                         "params": params}, sort_keys=True).encode())
+    # Row by row, so strided views (e.g. of a QImage) are hashed without a full copy
+    image = np.asarray(image)
+    if image.flags.c_contiguous:
+        h.update(memoryview(image).cast("B"))
+    else:
+        for row in image:
+            h.update(np.ascontiguousarray(row).data)
+    return h.hexdigest()
+
+def load_npz_mapped(path):
+    """
+    Arrays of an uncompressed .npz as read-only views of a memory map of the file (no copy).
+    Members that are compressed are read normally.
+    """
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) # Stays open while arrays view it
+        for info in archive.infolist():
+            name = info.filename[:-4] if info.filename.endswith(".npy") else info.filename
+            if info.compress_type != zipfile.ZIP_STORED:
+                with archive.open(info) as member:
+                    arrays[name] = np.lib.format.read_array(member)
+                continue
+            # Skip the member's local header to reach the .npy data
+            f.seek(info.header_offset + 26)
+            name_len, extra_len = np.frombuffer(f.read(4), "<u2")
+            f.seek(info.header_offset + 30 + int(name_len) + int(extra_len))
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran, dtype = np.lib.format.read_array_header_2_0(f)
+            if dtype.hasobject:
+                raise ValueError(f"Object array in cache entry: {name}")
+            # Plain ndarrays over the mapping; np.memmap slicing is too slow for per-piece views
+            count = int(np.prod(shape))
+            array = np.frombuffer(data, dtype=dtype, count=count, offset=f.tell()) if count else np.empty(0, dtype)
+            arrays[name] = array.reshape(shape, order="F" if fortran else "C")
+    return arrays
+
+class ResultCache:
+    """
+    Directory of cached piece sets and matches. Entries are looked up by cache_key; each hit
+    refreshes the entry's modification time, and storing evicts the least recently used
+    entries until the directory is within max_bytes.
+    """
+    def __init__(self, directory=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".npz")
+
+    def load(self, key, image):
+        """
+        (pieces, matches) stored under key, or None. image is the frame the pieces were
+        detected in; it becomes their FrameSource. Contours are views of the memory-mapped entry.
+        """
+        path = self.path(key)
+        with metrics.timer("cache_load"):
+            try:
+                arrays = load_npz_mapped(path)
+            except (OSError, ValueError, zipfile.BadZipFile):
+                metrics.count("cache_misses")
+                return None
+            os.utime(path) # Most recently used
+            result = unpack_results(arrays, image)
+        metrics.count("cache_hits")
+        return result
+
+    def store(self, key, pieces, matches):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(key)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with metrics.timer("cache_store"):
+            try:
+                with open(tmp, "wb") as f:
+                    np.savez(f, **pack_results(pieces, matches))
+                os.replace(tmp, path) # Readers never see a partial entry
+            except BaseException:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                raise
+            self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".npz"):
+                path = os.path.join(self.directory, name)
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue # In use or already gone
+            total -= size
+
+    def clear(self):
+        if os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if name.endswith(".npz"):
+                    os.remove(os.path.join(self.directory, name))
+
+def pack_results(pieces, matches):
+    """Arrays of a cache entry: the PieceStore of the pieces, corners, side descriptors and matches."""
+    store = pieces[0].store if pieces else None
+    if store is None or store.pieces != list(pieces):
+        store = PieceStore(pieces)
+    n = len(pieces)
+    corners = np.full((n, 4), -1, dtype=np.int64)
+    hu = np.zeros((n, 4, 7))
+    endpoints = np.zeros((n, 4, 2))
+    signatures = np.zeros((n, 4, 2 * SIGNATURE_POINTS))
+    for row, piece in enumerate(store.pieces):
+        if piece.corners is not None:
+            corners[row] = piece.corners
+        for i, side in enumerate(piece.sides):
+            if side is not None and side.descriptor is not None:
+                hu[row, i] = side.descriptor.hu
+                endpoints[row, i] = side.descriptor.endpoints
+                signatures[row, i] = side.descriptor.signature
+    rows = {piece: row for row, piece in enumerate(store.pieces)}
+    return {
+        "ids": store.ids,
+        "origins": store.origins,
+        "centers": store.centers,
+        "rotations": store.rotations,
+        "side_types": store.side_types,
+        "offsets": store.offsets,
+        "points": store.points,
+        "contour_ranges": store.contour_ranges,
+        "side_ranges": store.side_ranges,
+        "corners": corners,
+        "hu": hu,
+        "endpoints": endpoints,
+        "signatures": signatures,
+        "match_rows": np.array([(rows[m["p1"]], m["s1"], rows[m["p2"]], m["s2"]) for m in matches],
+                               dtype=np.int64).reshape(-1, 4),
+        "match_scores": np.array([m["score"] for m in matches], dtype=np.float64),
+    }
+
+STORE_ARRAYS = ("ids", "origins", "centers", "rotations", "side_types", "offsets", "points",
+                "contour_ranges", "side_ranges") # PieceStore.from_arrays arguments
+
+def unpack_results(arrays, image):
+    """
+    Pieces and match dicts from the arrays of a cache entry. The pieces' PieceStore is made of
+    the entry's arrays, so contours stay views of them (of the memory map, for a mapped entry).
+    """
+    source = FrameSource(image)
+    points = arrays["points"]
+    hu, endpoints, signatures = arrays["hu"], arrays["endpoints"], arrays["signatures"]
+    lengths = np.linalg.norm(endpoints, axis=-1).tolist()
+    contour_ranges = arrays["contour_ranges"].tolist()
+    side_ranges = arrays["side_ranges"].tolist()
+    side_types = arrays["side_types"].tolist()
+    corners = arrays["corners"]
+    has_corners = (corners[:, 0] >= 0).tolist()
+    pieces = []
+    for row, (piece_id, origin, rotation) in enumerate(zip(arrays["ids"].tolist(), arrays["origins"].tolist(),
+                                                           arrays["rotations"].tolist())):
+        start, stop = contour_ranges[row]
+        piece = Piece(piece_id, points[start:stop], None, origin_offset=tuple(origin), source=source)
+        piece.rotation = rotation
+        if has_corners[row]:
+            piece.corners = corners[row]
+        for i in range(4):
+            if side_types[row][i] < 0:
+                continue
+            start, stop = side_ranges[row][i]
+            descriptor = SideDescriptor.restore(hu[row, i], endpoints[row, i], signatures[row, i], lengths[row][i])
+            piece.set_side(i, Side(points[start:stop], SideType(side_types[row][i]), descriptor))
+        pieces.append(piece)
+    PieceStore.from_arrays(pieces, *(arrays[name] for name in STORE_ARRAYS))
+
+    matches = [{
+        "p1": pieces[i], "s1": s1,
+        "p2": pieces[j], "s2": s2,
+        "score": score
+    } for (i, s1, j, s2), score in zip(arrays["match_rows"].tolist(), arrays["match_scores"].tolist())]
+    return pieces, matches
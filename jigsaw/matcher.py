@@ -1,64 +1,626 @@
+import os
+import time
+import bisect
+from concurrent.futures import ProcessPoolExecutor
 import cv2
 import numpy as np
-from .piece import Piece, SideType
+from .piece import Piece, SideType, SideDescriptor, SIGNATURE_POINTS, COLOR_BINS, reverse_signature, strip_histogram
+from . import metrics
 
-def find_matches(pieces: list[Piece]):
+LENGTH_TOLERANCE = 100 # Max chord length difference in pixels (fairly loose)
+SCORE_THRESHOLD = 0.1 # matchShapes threshold (experimental)
+COLOR_THRESHOLD = 0.5 # Largest colour strip distance (1 - histogram intersection) of a match
+UNSCORED = 1e9 # Score of a match no stage of the cascade could score (finite, so it sorts and serializes)
+CASCADE = ("color", "hu") # Pair stages after the type and length checks, cheapest first
+COLOR_CHUNK = 1 << 14 # Pairs per colour strip comparison (cache sized, each pair gathers two histograms)
+ALIGN_TOP_K = 5 # Candidates per side the "align" stage verifies, best first (see align_stage)
+ALIGN_THRESHOLD = 2.0 # Largest alignment residual of a match, in pixels
+ALIGN_ACCEPT = 0.5 # A side's remaining candidates are not verified once one aligns within this residual
+ALIGN_CHUNK = 4096 # Pairs aligned per vectorized batch (each compares every point with every segment)
+HU_EPS = 1e-5 # Hu moments below this are ignored, as in cv2.matchShapes
+PAIR_CHUNK = 1 << 20 # Candidate pairs scored per vectorized batch (bounds memory)
+PARALLEL_MIN_SIDES = 2000 # Fewer TAB sides than this are not worth a process pool
+STREAM_CHUNK = 1 << 16 # Smaller batches for iter_matches, so the first matches arrive early
+STREAM_TOP_K = 5 # Candidates kept per TAB side by iter_matches
+ANN_NEIGHBOURS = 8 # Nearest SOCKET signatures looked up per TAB by the "ann" backend
+ANN_CHECKS = 64 # FLANN leaf checks per query: the recall/speed knob of the "ann" backend
+ANN_TREES = 4 # Randomized KD-trees in the FLANN forest
+FLANN_INDEX_KDTREE = 1
+
+def describe(side, piece=None):
+    """
+    Returns the side's descriptor, computing it if the side was built without one.
+    Given the side's piece, the colour strip of the side is computed too if it is still missing.
+    """
+    if side.descriptor is None:
+        side.descriptor = SideDescriptor(side.contour)
+    descriptor = side.descriptor
+    if piece is not None and descriptor.colors is None:
+        descriptor.colors = strip_histogram(piece.image, piece.contour, side.contour)
+    return descriptor
+
+def match_settings(cascade=CASCADE):
+    """The settings that decide which matches are found, e.g. to key cached results."""
+    return {"cascade": list(cascade), "length_tolerance": LENGTH_TOLERANCE,
+            "color_threshold": COLOR_THRESHOLD, "score_threshold": SCORE_THRESHOLD,
+            "align_top_k": ALIGN_TOP_K, "align_threshold": ALIGN_THRESHOLD, "align_accept": ALIGN_ACCEPT}
+
+def side_length(side):
+    """Length of the vector between the two endpoints of a side (its chord)."""
+    return describe(side).length
+
+def mating_type(side_type):
+    """A TAB mates with a SOCKET and vice versa. FLAT sides never mate."""
+    if side_type == SideType.TAB:
+        return SideType.SOCKET
+    if side_type == SideType.SOCKET:
+        return SideType.TAB
+    return None
+
+def log_hu(hu):
+    """
+    Transforms Hu moments (..., 7) the way cv2.matchShapes does for CONTOURS_MATCH_I1:
+    m -> 1 / (sign(m) * log10|m|). Returns (values, valid) where valid masks out
+    moments too small to be used.
+    """
+    hu = np.asarray(hu, dtype=np.float64)
+    mag = np.abs(hu)
+    valid = mag > HU_EPS
+    with np.errstate(divide="ignore", invalid="ignore"):
+        values = np.where(valid, 1.0 / (np.sign(hu) * np.log10(np.where(valid, mag, 1.0))), 0.0)
+    return values, valid
+
+def match_scores(values1, valid1, values2, valid2):
+    """
+    Vectorized CONTOURS_MATCH_I1 between rows of two log-Hu matrices (as returned by log_hu).
+    Inputs broadcast against each other; returns one score per row.
+    """
+    both = valid1 & valid2
+    scores = np.where(both, np.abs(values2 - values1), 0.0).sum(axis=-1)
+    metrics.count("match_shapes", scores.size)
+    # matchShapes gives up (DBL_MAX) when only one of the shapes has usable moments
+    mismatch = valid1.any(axis=-1) != valid2.any(axis=-1)
+    return np.where(mismatch, np.finfo(np.float64).max, scores)
+
+class SideBucket:
+    """Sides of one SideType, sorted by chord length, with their descriptors as contiguous arrays."""
+    def __init__(self, entries):
+        # entries: (length, piece_idx, side_idx, descriptor); sorting keeps piece/side order for equal lengths
+        entries.sort(key=lambda e: e[:3])
+        n = len(entries)
+        self.lengths = np.fromiter((e[0] for e in entries), dtype=np.float64, count=n)
+        self.piece_idx = np.fromiter((e[1] for e in entries), dtype=np.int64, count=n)
+        self.side_idx = np.fromiter((e[2] for e in entries), dtype=np.int64, count=n)
+        hu = np.array([e[3].hu for e in entries], dtype=np.float64).reshape(n, 7)
+        self.hu, self.hu_valid = log_hu(hu)
+        self.signatures = np.array([e[3].signature for e in entries], dtype=np.float64).reshape(n, 2 * SIGNATURE_POINTS)
+        # Colour strips, all zeros where the side has none (piece without an image)
+        self.color_valid = np.fromiter((e[3].colors is not None for e in entries), dtype=bool, count=n)
+        self.colors = np.zeros((n, COLOR_BINS ** 3), dtype=np.uint8)
+        for k in np.flatnonzero(self.color_valid):
+            self.colors[k] = entries[k][3].colors
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def window(self, lengths, tolerance=LENGTH_TOLERANCE):
+        """[lo, hi) ranges of this bucket within tolerance of each of the given lengths."""
+        lo = np.searchsorted(self.lengths, lengths - tolerance, side="left")
+        hi = np.searchsorted(self.lengths, lengths + tolerance, side="right")
+        return lo, hi
+
+    def merge(self, other):
+        """Inserts the rows of another bucket, keeping this one sorted by length."""
+        at = np.searchsorted(self.lengths, other.lengths, side="right")
+        self.lengths = np.insert(self.lengths, at, other.lengths)
+        self.piece_idx = np.insert(self.piece_idx, at, other.piece_idx)
+        self.side_idx = np.insert(self.side_idx, at, other.side_idx)
+        self.hu = np.insert(self.hu, at, other.hu, axis=0)
+        self.hu_valid = np.insert(self.hu_valid, at, other.hu_valid, axis=0)
+        self.signatures = np.insert(self.signatures, at, other.signatures, axis=0)
+        self.colors = np.insert(self.colors, at, other.colors, axis=0)
+        self.color_valid = np.insert(self.color_valid, at, other.color_valid)
+
+    def remove(self, mask):
+        """Drops the rows selected by a boolean mask."""
+        keep = ~mask
+        self.lengths = self.lengths[keep]
+        self.piece_idx = self.piece_idx[keep]
+        self.side_idx = self.side_idx[keep]
+        self.hu = self.hu[keep]
+        self.hu_valid = self.hu_valid[keep]
+        self.signatures = self.signatures[keep]
+        self.colors = self.colors[keep]
+        self.color_valid = self.color_valid[keep]
+
+class SideIndex:
+    """
+    Index of the non-flat sides of a piece set, built once per piece set.
+    Sides are bucketed by SideType and sorted by chord length within each bucket,
+    so the candidates for a side are found by binary search on the length window.
+    Sides in skip, a set of (piece, side_idx), are left out.
+    """
+    def __init__(self, pieces: list[Piece], skip=None):
+        self.pieces = pieces
+
+        entries = {SideType.TAB: [], SideType.SOCKET: []}
+        for i, piece in enumerate(pieces):
+            for s_idx, side in enumerate(piece.sides):
+                if side is None or side.type not in entries or (skip and (piece, s_idx) in skip):
+                    continue
+                d = describe(side, piece)
+                entries[side.type].append((d.length, i, s_idx, d))
+
+        self.buckets = {side_type: SideBucket(e) for side_type, e in entries.items()}
+
+    def sides(self, side_type):
+        """All (piece_idx, side_idx, length) entries of the given type, by increasing length."""
+        bucket = self.buckets[side_type]
+        for k in range(len(bucket)):
+            yield int(bucket.piece_idx[k]), int(bucket.side_idx[k]), bucket.lengths[k]
+
+    def candidates(self, side_type, length, tolerance=LENGTH_TOLERANCE):
+        """
+        Returns (piece_idx, side_idx) pairs of the given type whose chord length is
+        within tolerance of length.
+        """
+        bucket = self.buckets[side_type]
+        lo, hi = bucket.window(length, tolerance)
+        ks = np.arange(lo, hi)
+        # Exact check as well, so the window agrees with abs(l1 - l2) <= tolerance
+        ks = ks[np.abs(length - bucket.lengths[ks]) <= tolerance]
+        return [(int(bucket.piece_idx[k]), int(bucket.side_idx[k])) for k in ks]
+
+    def candidate_pairs(self, tolerance=LENGTH_TOLERANCE):
+        """Yields (tab_rows, socket_rows) candidate arrays, see candidate_pairs()."""
+        return candidate_pairs(self.buckets[SideType.TAB], self.buckets[SideType.SOCKET], tolerance=tolerance)
+
+    def score_pairs(self, tab_rows, socket_rows):
+        """CONTOURS_MATCH_I1 score for each TAB/SOCKET row pair."""
+        return score_pairs(self.buckets[SideType.TAB], self.buckets[SideType.SOCKET], tab_rows, socket_rows)
+
+def candidate_pairs(tabs, sockets, start=0, stop=None, tolerance=LENGTH_TOLERANCE, chunk=PAIR_CHUNK):
+    """
+    Yields (tab_rows, socket_rows) arrays of TAB/SOCKET bucket rows that pass the
+    length check and belong to different pieces, in chunks of at most about chunk pairs.
+    Only TAB rows in [start, stop) are queried. A TAB row is never split across chunks.
+    """
+    stop = len(tabs) if stop is None else stop
+    if start >= stop or len(sockets) == 0:
+        return
+
+    lo, hi = sockets.window(tabs.lengths[start:stop], tolerance)
+    counts = hi - lo
+    # Everything outside the length windows is rejected without being looked at
+    metrics.count("length_filter_rejects", (stop - start) * len(sockets) - int(counts.sum()))
+    pos = 0
+    while pos < len(counts):
+        # Take as many TAB rows as fit in one chunk (at least one)
+        cum = np.cumsum(counts[pos:])
+        end = pos + max(1, int(np.searchsorted(cum, chunk, side="right")))
+        n = counts[pos:end]
+        tab_rows = np.repeat(np.arange(start + pos, start + end), n)
+        # Socket rows: lo[t] + 0..n[t]-1 for each TAB row t
+        offsets = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+        socket_rows = np.repeat(lo[pos:end], n) + offsets
+
+        keep = np.abs(tabs.lengths[tab_rows] - sockets.lengths[socket_rows]) <= tolerance
+        keep &= tabs.piece_idx[tab_rows] != sockets.piece_idx[socket_rows]
+        passes = int(keep.sum())
+        metrics.count("length_filter_passes", passes)
+        metrics.count("length_filter_rejects", len(keep) - passes)
+        yield tab_rows[keep], socket_rows[keep]
+        pos = end
+
+def score_pairs(tabs, sockets, tab_rows, socket_rows):
+    """CONTOURS_MATCH_I1 score for each TAB/SOCKET row pair."""
+    return match_scores(tabs.hu[tab_rows], tabs.hu_valid[tab_rows],
+                        sockets.hu[socket_rows], sockets.hu_valid[socket_rows])
+
+def color_distances(tabs, sockets, tab_rows, socket_rows):
+    """
+    1 - histogram intersection of the colour strips of each TAB/SOCKET row pair, from 0 (same
+    colours) to 1 (no colour in common). Pairs where either side has no colour strip get NaN.
+    """
+    common = np.empty(len(tab_rows), dtype=np.uint16)
+    for i in range(0, len(tab_rows), COLOR_CHUNK):
+        t, s = tab_rows[i:i + COLOR_CHUNK], socket_rows[i:i + COLOR_CHUNK]
+        both = np.take(tabs.colors, t, axis=0)
+        np.minimum(both, np.take(sockets.colors, s, axis=0), out=both)
+        common[i:i + COLOR_CHUNK] = both.sum(axis=1, dtype=np.uint16)
+    valid = tabs.color_valid[tab_rows] & sockets.color_valid[socket_rows]
+    return np.where(valid, np.maximum(1.0 - common / 255, 0.0), np.nan)
+
+def side_curves(bucket, rows, reverse=False):
+    """
+    Sides of bucket rows as (n, SIGNATURE_POINTS + 2, 2) polylines in pixels, rigidly placed with
+    the midpoint of their chord at the origin and the chord along x (from their shape signatures).
+    reverse walks each side from its other end, as the contour of its mate does.
+    """
+    signatures = bucket.signatures[rows]
+    if reverse:
+        signatures = reverse_signature(signatures)
+    x, y = np.split(signatures, 2, axis=1)
+    half = 0.5 * bucket.lengths[rows][:, None]
+    interior = np.stack(((2 * x - 1) * half, 2 * y * half), axis=-1)
+    start = np.stack((-half, np.zeros_like(half)), axis=-1)
+    return np.concatenate((start, interior, -start), axis=1)
+
+def curve_distances(points, curves):
+    """Distance of each of the (n, p, 2) points to the polyline of the same row of (n, m, 2) curves."""
+    a = curves[:, :-1, None, :]
+    d = curves[:, 1:, None, :] - a
+    ap = points[:, None, :, :] - a
+    t = np.clip((ap * d).sum(axis=-1) / np.maximum((d * d).sum(axis=-1), 1e-12), 0.0, 1.0)
+    gap = ap - t[..., None] * d
+    return np.sqrt((gap * gap).sum(axis=-1).min(axis=1))
+
+def signature_distances(tabs, sockets, tab_rows, socket_rows):
+    """
+    RMS distance, in pixels, between the shape signature points of each TAB/SOCKET row pair, the
+    SOCKET's walked from its other end. A cheap stand-in for alignment_residuals: points are only
+    compared with the point of the same index, not with the whole other curve.
+    """
+    distances = np.empty(len(tab_rows))
+    for i in range(0, len(tab_rows), COLOR_CHUNK):
+        t, s = tab_rows[i:i + COLOR_CHUNK], socket_rows[i:i + COLOR_CHUNK]
+        gap = tabs.signatures[t] - reverse_signature(sockets.signatures[s])
+        distances[i:i + COLOR_CHUNK] = np.sqrt(2 * (gap * gap).mean(axis=1)) * tabs.lengths[t]
+    return distances
+
+def alignment_residuals(tabs, sockets, tab_rows, socket_rows):
+    """
+    Rigidly aligns each TAB/SOCKET row pair on the endpoints of the sides and returns the RMS distance,
+    in pixels, between the two curves (both ways, so it is symmetric). Unlike the Hu score it is not
+    invariant to scale or mirroring, so mis-scaled or mirrored look-alikes do not align.
+    """
+    residuals = np.empty(len(tab_rows))
+    for i in range(0, len(tab_rows), ALIGN_CHUNK):
+        tab_curves = side_curves(tabs, tab_rows[i:i + ALIGN_CHUNK])
+        socket_curves = side_curves(sockets, socket_rows[i:i + ALIGN_CHUNK], reverse=True)
+        # Interior points only: the endpoints are where the two sides were aligned
+        d = np.concatenate((curve_distances(tab_curves[:, 1:-1], socket_curves),
+                            curve_distances(socket_curves[:, 1:-1], tab_curves)), axis=1)
+        residuals[i:i + ALIGN_CHUNK] = np.sqrt((d * d).mean(axis=1))
+    return residuals
+
+def color_stage(tabs, sockets, tab_rows, socket_rows, scores):
+    # Pairs without colour strips pass, unscored
+    scores = color_distances(tabs, sockets, tab_rows, socket_rows)
+    return ~(scores > COLOR_THRESHOLD), scores
+
+def hu_stage(tabs, sockets, tab_rows, socket_rows, scores):
+    scores = score_pairs(tabs, sockets, tab_rows, socket_rows)
+    return scores < SCORE_THRESHOLD, scores
+
+def align_stage(tabs, sockets, tab_rows, socket_rows, scores):
+    """
+    Verifies the ALIGN_TOP_K best candidates of each side of the first bucket, best first, with
+    alignment_residuals. A side's remaining candidates are skipped once one of them aligns within
+    ALIGN_ACCEPT. Candidates that are not verified are dropped.
+    Candidates are ranked by the previous stage's score, then by signature_distances, which alone
+    ranks them when no stage could score them (e.g. "color" on pieces without images, or "align"
+    as the first stage) and breaks the ties of coarse scores.
+    """
+    best = top_k_per_group(tab_rows, scores, ALIGN_TOP_K,
+                           ties=signature_distances(tabs, sockets, tab_rows, socket_rows))
+    groups = tab_rows[best]
+    rank = np.arange(len(best)) - np.searchsorted(groups, groups, side="left")
+
+    residuals = np.full(len(tab_rows), np.inf)
+    accepted = np.zeros(len(tabs), dtype=bool) # Sides whose mate has been found
+    for r in range(ALIGN_TOP_K):
+        batch = best[rank == r]
+        pending = batch[~accepted[tab_rows[batch]]]
+        metrics.count("align_skipped", len(batch) - len(pending))
+        if len(pending) == 0:
+            break
+        residuals[pending] = alignment_residuals(tabs, sockets, tab_rows[pending], socket_rows[pending])
+        accepted[tab_rows[pending[residuals[pending] <= ALIGN_ACCEPT]]] = True
+    return residuals <= ALIGN_THRESHOLD, residuals
+
+# Pair stages by name: stage(tabs, sockets, tab_rows, socket_rows, scores) -> (keep mask, scores).
+# A NaN score means the stage could not score the pair; the pair keeps its previous score.
+STAGES = {
+    "color": color_stage, # Colour strip distance along the sides, very cheap and selective
+    "hu": hu_stage, # matchShapes score of the side contours
+    "align": align_stage, # Rigid alignment residual in pixels, on the top candidates of each side only
+}
+
+def check_cascade(cascade):
+    """Raises ValueError for a cascade that cannot be run (no stages, or unknown ones)."""
+    if not cascade:
+        raise ValueError("The match cascade needs at least one stage")
+    unknown = [name for name in cascade if name not in STAGES]
+    if unknown:
+        raise ValueError(f"Unknown match stages: {', '.join(unknown)}")
+
+def run_cascade(tabs, sockets, tab_rows, socket_rows, cascade=CASCADE):
+    """
+    Runs candidate pairs through the pair stages of a cascade, in order, each stage seeing only the
+    pairs the previous ones kept. The SideType and length checks are the first two stages: they are
+    built into the SideBucket / candidate_pairs search, so the pairs they reject are never made.
+    Each stage counts the pairs it keeps and prunes as <stage>_filter_passes / _rejects.
+    Returns the surviving (tab_rows, socket_rows, scores), scores being those of the last stage
+    that could score each pair (UNSCORED if none could, e.g. "color" alone on pieces without images).
+    """
+    scores = np.full(len(tab_rows), np.nan)
+    for name in cascade:
+        if len(tab_rows) == 0:
+            break
+        with metrics.timer(f"{name}_filter"):
+            keep, stage_scores = STAGES[name](tabs, sockets, tab_rows, socket_rows, scores)
+        scores = np.where(np.isnan(stage_scores), scores, stage_scores)
+        passes = int(keep.sum())
+        metrics.count(f"{name}_filter_passes", passes)
+        metrics.count(f"{name}_filter_rejects", len(keep) - passes)
+        tab_rows, socket_rows, scores = tab_rows[keep], socket_rows[keep], scores[keep]
+    return tab_rows, socket_rows, np.where(np.isnan(scores), UNSCORED, scores)
+
+def match_rows(tabs, sockets, start=0, stop=None, cascade=CASCADE):
+    """
+    Scores TAB rows [start, stop) against the SOCKET bucket.
+    Returns an (n, 5) array of [score, piece_idx1, side_idx1, piece_idx2, side_idx2] rows,
+    with every match in both directions (the score is symmetric).
+    """
+    found = [np.empty((0, 5))]
+    for tab_rows, socket_rows in candidate_pairs(tabs, sockets, start, stop):
+        found.extend(_good_matches(tabs, sockets, tab_rows, socket_rows, cascade))
+    return np.concatenate(found)
+
+def _good_matches(tabs, sockets, tab_rows, socket_rows, cascade=CASCADE):
+    # Runs candidate pairs through the cascade, returns the survivors as match rows in both directions
+    t, s, score = run_cascade(tabs, sockets, tab_rows, socket_rows, cascade)
+    ti, ts = tabs.piece_idx[t], tabs.side_idx[t]
+    si, ss = sockets.piece_idx[s], sockets.side_idx[s]
+    return np.stack([score, ti, ts, si, ss], axis=1), np.stack([score, si, ss, ti, ts], axis=1)
+
+def match_rows_ann(tabs, sockets, neighbours=ANN_NEIGHBOURS, checks=ANN_CHECKS, tolerance=LENGTH_TOLERANCE,
+                   cascade=CASCADE):
+    """
+    Same as match_rows, but the candidates of each TAB are its nearest SOCKET shape signatures,
+    looked up in a FLANN randomized KD-tree forest instead of scanning the length window.
+    Candidates still have to pass the length check before they are scored.
+
+    :param neighbours: Nearest SOCKETs looked up per TAB
+    :param checks: Leaves FLANN visits per query. Higher gives better recall, lower is faster
+    """
+    if len(tabs) == 0 or len(sockets) == 0:
+        return np.empty((0, 5))
+
+    # A SOCKET's contour walks the shared edge in the opposite direction to its TAB
+    targets = np.ascontiguousarray(reverse_signature(sockets.signatures), dtype=np.float32)
+    ann = cv2.flann_Index(targets, dict(algorithm=FLANN_INDEX_KDTREE, trees=ANN_TREES))
+    k = min(neighbours, len(sockets))
+    rows, _ = ann.knnSearch(np.ascontiguousarray(tabs.signatures, dtype=np.float32), k, params=dict(checks=checks))
+
+    tab_rows = np.repeat(np.arange(len(tabs)), k)
+    socket_rows = rows.ravel().astype(np.int64)
+    keep = socket_rows >= 0
+    tab_rows, socket_rows = tab_rows[keep], socket_rows[keep]
+    keep = np.abs(tabs.lengths[tab_rows] - sockets.lengths[socket_rows]) <= tolerance
+    keep &= tabs.piece_idx[tab_rows] != sockets.piece_idx[socket_rows]
+    metrics.count("length_filter_passes", int(keep.sum()))
+    metrics.count("length_filter_rejects", len(keep) - int(keep.sum()))
+
+    return np.concatenate(_good_matches(tabs, sockets, tab_rows[keep], socket_rows[keep], cascade))
+
+# Side buckets and cascade of the current match, set once per worker process
+_worker_buckets = None
+
+def _init_worker(tabs, sockets, cascade=CASCADE):
+    global _worker_buckets
+    _worker_buckets = (tabs, sockets, cascade)
+
+def _match_shard(shard):
+    # Returns the rows and this shard's metrics, which the parent process merges
+    tabs, sockets, cascade = _worker_buckets
+    metrics.METRICS.reset()
+    return match_rows(tabs, sockets, *shard, cascade=cascade), metrics.METRICS.snapshot()
+
+def match_rows_parallel(tabs, sockets, workers, cascade=CASCADE):
+    """
+    Same as match_rows over all TAB rows, with the TAB rows sharded across a process pool.
+    Workers receive only the (array-only) side buckets, never the Piece objects.
+    """
+    n = len(tabs)
+    shard_size = max(1, -(-n // (workers * 4))) # A few shards per worker to balance load
+    shards = [(start, min(start + shard_size, n)) for start in range(0, n, shard_size)]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(tabs, sockets, cascade)) as pool:
+        found = [np.empty((0, 5))]
+        for rows, snapshot in pool.map(_match_shard, shards):
+            found.append(rows)
+            metrics.METRICS.merge(snapshot)
+        return np.concatenate(found)
+
+def find_matches(pieces: list[Piece], workers=1, backend="length", neighbours=ANN_NEIGHBOURS, checks=ANN_CHECKS,
+                 cascade=CASCADE, skip=None):
     """
     Iterates through pieces and finds matches between Tabs and Sockets.
-    Returns a list of matches: [(piece1, side_idx1, piece2, side_idx2, score), ...]
-    """
-    matches = []
-    
-    # Simple exhaustive search
-    # In a real app, use spatial hashing or filter by side length first
-    
-    for i, p1 in enumerate(pieces):
-        for s1_idx, side1 in enumerate(p1.sides):
-            if side1 is None or side1.type == SideType.FLAT:
+    Returns a list of matches: [{"p1", "s1", "p2", "s2", "score"}, ...] sorted by score.
+    Each pair is reported twice, once from the TAB side and once from the SOCKET side.
+
+    :param workers: Number of worker processes (None for one per CPU). Inputs with fewer than
+                    PARALLEL_MIN_SIDES TAB sides are always matched serially.
+    :param backend: "length" scores every SOCKET in each TAB's length window (exhaustive).
+                    "ann" only scores each TAB's nearest SOCKETs by shape signature (approximate,
+                    sub-linear per query, for very large puzzles). It always runs serially.
+    :param neighbours: "ann" backend only, nearest SOCKETs looked up per TAB
+    :param checks: "ann" backend only, FLANN checks per query (higher: better recall, slower)
+    :param cascade: Names of the STAGES candidate pairs go through after the length check, in order.
+                    The score of a match is that of the last stage (the Hu score by default)
+    :param skip: Set of (piece, side_idx) sides to leave out, e.g. sides already solved
+    """
+    if backend not in ("length", "ann"):
+        raise ValueError(f"Unknown matching backend: {backend}")
+    check_cascade(cascade)
+
+    with metrics.timer("match"):
+        index = SideIndex(pieces, skip)
+        tabs = index.buckets[SideType.TAB]
+        sockets = index.buckets[SideType.SOCKET]
+
+        workers = workers or os.cpu_count() or 1
+        if backend == "ann":
+            found = match_rows_ann(tabs, sockets, neighbours, checks, cascade=cascade)
+        elif workers > 1 and len(tabs) >= PARALLEL_MIN_SIDES:
+            found = match_rows_parallel(tabs, sockets, workers, cascade)
+        else:
+            found = match_rows(tabs, sockets, cascade=cascade)
+
+    return matches_from_rows(pieces, found)
+
+def matches_from_rows(pieces, found):
+    """Match dicts for the rows of a match_rows array, sorted by score."""
+    # Sort by best score, ties in piece/side order
+    order = np.lexsort((found[:, 4], found[:, 3], found[:, 2], found[:, 1], found[:, 0]))
+
+    return [{
+        "p1": pieces[int(i)], "s1": int(s1_idx),
+        "p2": pieces[int(j)], "s2": int(s2_idx),
+        "score": float(score)
+    } for score, i, s1_idx, j, s2_idx in found[order]]
+
+def top_k_per_group(groups, scores, k, ties=None):
+    """
+    Indices of the k lowest scores within each group, ordered by group then score. NaN scores
+    come last. ties, if given, orders entries of equal score (NaN ones included), lowest first.
+    """
+    order = np.lexsort((scores, groups) if ties is None else (ties, scores, groups))
+    g = groups[order]
+    # Rank of each entry within its group
+    rank = np.arange(len(g)) - np.searchsorted(g, g, side="left")
+    return order[rank < k]
+
+def iter_matches(pieces: list[Piece], k=STREAM_TOP_K, index=None, cascade=CASCADE, cancelled=None):
+    """
+    Lazily yields matches as {"p1", "s1", "p2", "s2", "score"} dicts, p1/s1 being the TAB side.
+    Unlike find_matches, each unordered pair is yielded once, and only if it is among the k best
+    candidates of its TAB side. Sides are processed in batches and each batch is yielded sorted
+    by score as soon as it is scored, so the stream as a whole is not sorted.
+
+    :param k: Candidates kept per TAB side
+    :param index: A SideIndex of pieces, if one has already been built
+    :param cascade: Names of the STAGES candidate pairs go through after the length check, in order.
+                    The score of a match is that of the last stage (the Hu score by default)
+    :param cancelled: Callable checked before each batch is scored; the stream ends early once it
+                      returns True (batches without matches yield nothing, so checking between
+                      matches is not enough)
+    """
+    check_cascade(cascade)
+    start = time.perf_counter()
+    index = index or SideIndex(pieces)
+    tabs = index.buckets[SideType.TAB]
+    sockets = index.buckets[SideType.SOCKET]
+
+    # Batches hold whole TAB rows, so each TAB's top k is final once its batch is scored
+    for tab_rows, socket_rows in candidate_pairs(tabs, sockets, chunk=STREAM_CHUNK):
+        if cancelled is not None and cancelled():
+            return
+        t, s, score = run_cascade(tabs, sockets, tab_rows, socket_rows, cascade)
+
+        best = top_k_per_group(t, score, k)
+        best = best[np.argsort(score[best], kind="stable")]
+        # Only the time spent here counts as matching, not the time the consumer takes
+        metrics.METRICS.add_time("match", time.perf_counter() - start)
+        for r in best:
+            yield {
+                "p1": pieces[tabs.piece_idx[t[r]]], "s1": int(tabs.side_idx[t[r]]),
+                "p2": pieces[sockets.piece_idx[s[r]]], "s2": int(sockets.side_idx[s[r]]),
+                "score": float(score[r])
+            }
+        start = time.perf_counter()
+
+class MatchIndex:
+    """
+    Persistent match index for a growing piece set, e.g. pieces photographed in batches.
+    Keeps a ranked candidate list (score, piece, side_idx) for every non-flat side.
+    Adding or removing pieces only scores the sides of that batch against the index,
+    and updates the affected candidate lists in place. With an "align" stage, the top candidates
+    are picked per added batch, so they can differ from those find_matches keeps.
+    """
+    def __init__(self, pieces: list[Piece] = (), cascade=CASCADE):
+        check_cascade(cascade)
+        self.cascade = cascade
+        self.buckets = {SideType.TAB: SideBucket([]), SideType.SOCKET: SideBucket([])}
+        self._pieces = [] # Slot -> Piece (None once removed); buckets refer to pieces by slot
+        self._slots = {} # Piece -> slot
+        self._candidates = {} # (slot, side_idx) -> sorted [(score, other_slot, other_side_idx), ...]
+        if pieces:
+            self.add_pieces(pieces)
+
+    @property
+    def pieces(self):
+        return [p for p in self._pieces if p is not None]
+
+    def add_pieces(self, pieces: list[Piece]):
+        entries = {SideType.TAB: [], SideType.SOCKET: []}
+        for piece in pieces:
+            if piece in self._slots:
                 continue
-                
-            # We only look for matches for Sockets (to avoid duplicates, 
-            # or handle both but be careful).
-            # Let's say we look for a match for any non-flat side.
-            # If side1 is SOCKET, we look for TAB.
-            # If side1 is TAB, we look for SOCKET.
-            
-            target_type = SideType.TAB if side1.type == SideType.SOCKET else SideType.SOCKET
-            
-            for j, p2 in enumerate(pieces):
-                if i == j: 
+            slot = len(self._pieces)
+            self._pieces.append(piece)
+            self._slots[piece] = slot
+            for s_idx, side in enumerate(piece.sides):
+                if side is None or side.type not in entries:
                     continue
-                    
-                for s2_idx, side2 in enumerate(p2.sides):
-                    if side2 is None or side2.type != target_type:
-                        continue
-                        
-                    # Check compatibility
-                    
-                    # 1. Length check
-                    # Length of vector between endpoints
-                    l1 = np.linalg.norm(side1.contour[0][0] - side1.contour[-1][0])
-                    l2 = np.linalg.norm(side2.contour[0][0] - side2.contour[-1][0])
-                    
-                    if abs(l1 - l2) > 100: # Threshold in pixels (fairly loose)
-                        continue
-                        
-                    # 2. Shape matching
-                    # cv2.matchShapes returns a metric (lower is better)
-                    # We might need to rotate side2 to match orientation of side1?
-                    # matchShapes is rotation invariant!
-                    
-                    score = cv2.matchShapes(side1.contour, side2.contour, cv2.CONTOURS_MATCH_I1, 0)
-                    
-                    if score < 0.1: # Threshold (experimental)
-                        # High quality match
-                        matches.append({
-                            "p1": p1, "s1": s1_idx,
-                            "p2": p2, "s2": s2_idx,
-                            "score": score
-                        })
-                        
-    # Sort by best score
-    matches.sort(key=lambda x: x["score"])
-    
-    return matches
+                d = describe(side, piece)
+                entries[side.type].append((d.length, slot, s_idx, d))
+                self._candidates[(slot, s_idx)] = []
+
+        new_tabs = SideBucket(entries[SideType.TAB])
+        new_sockets = SideBucket(entries[SideType.SOCKET])
+        tabs = self.buckets[SideType.TAB]
+        sockets = self.buckets[SideType.SOCKET]
+
+        # New TABs against all SOCKETs (old and new), then new SOCKETs against the old TABs
+        sockets.merge(new_sockets)
+        self._score(new_tabs, sockets)
+        self._score(new_sockets, tabs)
+        tabs.merge(new_tabs)
+
+    def remove_pieces(self, pieces: list[Piece]):
+        slots = [self._slots.pop(piece) for piece in pieces if piece in self._slots]
+        removed = set(slots)
+        affected = set() # Sides that hold back-references to the removed sides
+        for slot in slots:
+            for s_idx in range(4):
+                affected.update((o_slot, o_side) for _, o_slot, o_side in self._candidates.pop((slot, s_idx), []))
+            self._pieces[slot] = None
+        # Drop the back-references by slot, not by looking up their score
+        for key in affected:
+            ranked = self._candidates.get(key)
+            if ranked is not None:
+                ranked[:] = [entry for entry in ranked if entry[1] not in removed]
+
+        for bucket in self.buckets.values():
+            bucket.remove(np.isin(bucket.piece_idx, slots))
+
+    def ranked(self, piece: Piece, side_idx):
+        """Candidates of one side as [(score, piece, side_idx), ...], best first."""
+        slot = self._slots[piece]
+        return [(score, self._pieces[o_slot], o_side)
+                for score, o_slot, o_side in self._candidates.get((slot, side_idx), [])]
+
+    def matches(self):
+        """All matches in the same form and order as find_matches (each pair in both directions)."""
+        found = [(score, slot, s_idx, o_slot, o_side)
+                 for (slot, s_idx), ranked in self._candidates.items()
+                 for score, o_slot, o_side in ranked]
+        found.sort()
+        return [{
+            "p1": self._pieces[slot], "s1": s_idx,
+            "p2": self._pieces[o_slot], "s2": o_side,
+            "score": score
+        } for score, slot, s_idx, o_slot, o_side in found]
+
+    def _score(self, queries, targets):
+        # The score is symmetric, so either side type can be the query
+        for q_rows, t_rows in candidate_pairs(queries, targets):
+            for q, t, score in zip(*run_cascade(queries, targets, q_rows, t_rows, self.cascade)):
+                a = (int(queries.piece_idx[q]), int(queries.side_idx[q]))
+                b = (int(targets.piece_idx[t]), int(targets.side_idx[t]))
+                score = float(score)
+                bisect.insort(self._candidates[a], (score,) + b)
+                bisect.insort(self._candidates[b], (score,) + a)
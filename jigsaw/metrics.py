@@ -0,0 +1,119 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+# Timers and counters for the stages of the detection / matching pipeline.
+# Stage timers: decode, to_opencv, threshold, morphology, find_contours, analyze, match,
+# match_border, render_pieces, render_matches, cache_load, cache_store. Counters: pieces_analyzed, pieces_without_corners,
+# length_filter_passes, length_filter_rejects, match_shapes, cache_hits, cache_misses, roi_regrows.
+# Each match cascade stage (matcher.CASCADE) adds a <stage>_filter timer and
+# <stage>_filter_passes / <stage>_filter_rejects counters; "align" also counts align_skipped,
+# the candidates it did not verify because their side had already aligned.
+
+METRICS_ENV = "JIGSAW_METRICS" # JSON lines file the GUI appends a record to after each run
+PROFILE_ENV = "JIGSAW_PROFILE" # cProfile stats file written for each GUI run
+
+class Metrics:
+    """
+    Thread-safe stage timers (total seconds and calls) and counters of one process.
+    Worker processes have their own; their snapshots are merged into the parent's.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._listeners = []
+        self.timers = {} # Name -> [seconds, calls]
+        self.counters = {} # Name -> count
+
+    def reset(self):
+        with self._lock:
+            self.timers = {}
+            self.counters = {}
+
+    def add_time(self, name, seconds, calls=1):
+        with self._lock:
+            timer = self.timers.setdefault(name, [0.0, 0])
+            timer[0] += seconds
+            timer[1] += calls
+            listeners = list(self._listeners)
+        for listener in listeners:
+            listener(name, seconds)
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + int(n)
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_listener(self, listener):
+        """Trace hook: listener(name, seconds) is called as each timed stage ends, on its thread."""
+        with self._lock:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        with self._lock:
+            self._listeners.remove(listener)
+
+    def snapshot(self):
+        """JSON-ready copy: {"timers": {name: {"seconds", "calls"}}, "counters": {name: n}}."""
+        with self._lock:
+            return {
+                "timers": {name: {"seconds": s, "calls": c} for name, (s, c) in self.timers.items()},
+                "counters": dict(self.counters),
+            }
+
+    def merge(self, snapshot):
+        """Adds a snapshot (e.g. from a worker process) to these metrics."""
+        for name, timer in snapshot["timers"].items():
+            with self._lock:
+                total = self.timers.setdefault(name, [0.0, 0])
+                total[0] += timer["seconds"]
+                total[1] += timer["calls"]
+        for name, n in snapshot["counters"].items():
+            self.count(name, n)
+
+METRICS = Metrics() # Metrics of this process, recorded by the pipeline
+
+def timer(name):
+    return METRICS.timer(name)
+
+def count(name, n=1):
+    METRICS.count(name, n)
+
+class JsonLinesSink:
+    """Appends one JSON object per line to a file, with the time it was written."""
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        line = json.dumps({"time": time.time(), **record})
+        with self._lock, open(self.path, "a") as f:
+            f.write(line + "\n")
+
+def sink_from_env():
+    """JsonLinesSink for the file named by JIGSAW_METRICS, or None if it is not set."""
+    path = os.environ.get(METRICS_ENV)
+    return JsonLinesSink(path) if path else None
+
+@contextmanager
+def profiled(path=None):
+    """Runs the block under cProfile and writes the stats to path; does nothing if path is None."""
+    if not path:
+        yield
+        return
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
@@ -1,3 +1,5 @@
+import threading
+from collections import OrderedDict
 import cv2
 import numpy as np
 from enum import Enum
@@ -7,27 +9,193 @@ class SideType(Enum):
     TAB = 1 # Outward calibration
     SOCKET = 2 # Inward calibration
 
+SIGNATURE_POINTS = 16 # Points resampled along a side for its shape signature
+
+def side_signature(contour_segment, points=SIGNATURE_POINTS):
+    """
+    Fixed-length shape signature of a side: the segment resampled at equal arc length steps,
+    expressed in the frame of its chord (start at the origin, end at (1, 0)).
+    Returns [x_1..x_n, y_1..y_n] for the n interior sample points.
+    """
+    pts = contour_segment[:, 0, :].astype(np.float64)
+    chord = pts[-1] - pts[0]
+    chord_len = np.linalg.norm(chord)
+    arc = np.concatenate(([0.0], np.cumsum(np.linalg.norm(np.diff(pts, axis=0), axis=1))))
+    if chord_len == 0 or arc[-1] == 0:
+        return np.zeros(2 * points)
+
+    t = np.linspace(0, arc[-1], points + 2)[1:-1] # Endpoints are always (0,0) and (1,0)
+    rel = np.stack((np.interp(t, arc, pts[:, 0]), np.interp(t, arc, pts[:, 1])), axis=1) - pts[0]
+    u = chord / chord_len
+    v = np.array([-u[1], u[0]])
+    return np.concatenate((rel @ u, rel @ v)) / chord_len
+
+def reverse_signature(signature):
+    """
+    Signature of the same side walked from the other end (as its mate's contour walks it).
+    Works on a single signature or on rows of signatures.
+    """
+    x, y = np.split(signature, 2, axis=-1)
+    return np.concatenate((1.0 - x[..., ::-1], -y[..., ::-1]), axis=-1)
+
+STRIP_SAMPLES = 32 # Points sampled along a side for its colour strip
+STRIP_DEPTHS = (3, 6, 9) # Distances inside the piece, in pixels, at which the strip is sampled
+COLOR_BINS = 4 # Levels per channel of the colour strip histogram (COLOR_BINS^3 bins)
+
+def strip_histogram(image, contour, contour_segment, samples=STRIP_SAMPLES, depths=STRIP_DEPTHS):
+    """
+    Colour histogram of the strip of pixels just inside a piece along one of its sides.
+    Mating sides were cut from the same spot of the picture, so their strips look alike.
+    Returns COLOR_BINS^3 uint8 bins scaled to add up to about 255, or None without a BGR image.
+
+    :param image: BGR image of the piece, covering the bounding rect of contour
+    :param contour: Full contour of the piece, its orientation tells which way is inside
+    :param contour_segment: Contour points of the side
+    """
+    if image is None or image.ndim != 3 or image.shape[2] < 3 or image.size == 0 or len(contour_segment) < 2:
+        return None
+
+    pts = contour_segment[:, 0, :].astype(np.float64)
+    arc = np.concatenate(([0.0], np.cumsum(np.linalg.norm(np.diff(pts, axis=0), axis=1))))
+    if arc[-1] == 0:
+        return None
+    t = np.linspace(0, arc[-1], samples + 2)[1:-1] # Corners belong to two sides, skip them
+    along = np.stack((np.interp(t, arc, pts[:, 0]), np.interp(t, arc, pts[:, 1])), axis=1)
+    tangent = np.gradient(along, axis=0)
+    tangent /= np.maximum(np.linalg.norm(tangent, axis=1, keepdims=True), 1e-9)
+    # The left normal points inside for contours of positive (OpenCV oriented) area
+    inside = 1.0 if cv2.contourArea(contour, oriented=True) > 0 else -1.0
+    normal = inside * np.stack((-tangent[:, 1], tangent[:, 0]), axis=1)
+
+    x0, y0, _, _ = cv2.boundingRect(contour)
+    strip = np.concatenate([along + d * normal for d in depths]) - (x0, y0)
+    h, w = image.shape[:2]
+    xs = np.clip(np.rint(strip[:, 0]), 0, w - 1).astype(np.intp)
+    ys = np.clip(np.rint(strip[:, 1]), 0, h - 1).astype(np.intp)
+    levels = image[ys, xs, :3].astype(np.intp) * COLOR_BINS >> 8
+    bins = (levels[:, 0] * COLOR_BINS + levels[:, 1]) * COLOR_BINS + levels[:, 2]
+    hist = np.bincount(bins, minlength=COLOR_BINS ** 3)
+    return np.rint(hist * (255 / len(bins))).astype(np.uint8) # Small enough to compare many pairs fast
+
+class SideDescriptor:
+    """Shape features of a side, computed once when the side is created."""
+    def __init__(self, contour_segment):
+        # Same moments cv2.matchShapes computes for a contour
+        self.hu = cv2.HuMoments(cv2.moments(contour_segment)).flatten()
+        self.endpoints = (contour_segment[-1][0] - contour_segment[0][0]).astype(np.float64) # Endpoint vector
+        self.length = float(np.linalg.norm(self.endpoints)) # Chord length
+        self.signature = side_signature(contour_segment)
+        self.colors = None # strip_histogram of the side, set when first matched with the piece's image
+
+    @classmethod
+    def restore(cls, hu, endpoints, signature, length=None):
+        """Descriptor from previously computed features (e.g. from a cache), without the contour."""
+        descriptor = cls.__new__(cls)
+        descriptor.hu = hu
+        descriptor.endpoints = endpoints
+        descriptor.length = float(np.linalg.norm(endpoints)) if length is None else length
+        descriptor.signature = signature
+        descriptor.colors = None
+        return descriptor
+
 class Side:
-    def __init__(self, contour_segment, side_type=SideType.FLAT):
+    __slots__ = ("contour", "type", "descriptor")
+
+    def __init__(self, contour_segment, side_type=SideType.FLAT, descriptor=None):
         self.contour = contour_segment
         self.type = side_type
-        self.descriptor = None # To be used for matching (e.g., shape features)
+        self.descriptor = descriptor # SideDescriptor used for matching (shape features)
+
+CROP_CACHE_BYTES = 256 * 1024 * 1024 # Size bound of the masked/rotated crop cache of a frame
+
+class FrameSource:
+    """
+    Source frame shared by the pieces detected in it. Piece images are views of the frame,
+    and masked or rotated crops are made on demand and kept in a size-bounded LRU cache.
+    """
+    def __init__(self, frame: np.ndarray, cache_bytes=CROP_CACHE_BYTES):
+        self.frame = frame
+        self.cache_bytes = cache_bytes
+        self._cache = OrderedDict() # (piece, kind, angle) -> image
+        self._cached_bytes = 0
+        self._lock = threading.Lock()
+
+    def crop(self, piece):
+        """View of the frame under the piece's bounding rect (no copy)."""
+        x, y, w, h = cv2.boundingRect(piece.contour)
+        ox, oy = piece.origin
+        return self.frame[oy+y:oy+y+h, ox+x:ox+x+w]
+
+    def masked(self, piece):
+        """BGRA copy of the piece's crop, transparent outside its contour."""
+        return self._cached((piece, "masked", 0), lambda: self._masked(piece))
+
+    def rotated(self, piece, angle):
+        """Masked crop rotated by angle degrees (counter-clockwise), enlarged to fit."""
+        return self._cached((piece, "rotated", angle), lambda: self._rotated(piece, angle))
+
+    def clear_cache(self):
+        with self._lock:
+            self._cache.clear()
+            self._cached_bytes = 0
+
+    def _cached(self, key, make):
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        img = make()
+        with self._lock:
+            if key not in self._cache:
+                self._cache[key] = img
+                self._cached_bytes += img.nbytes
+            # Evict least recently used crops, but always keep the newest one
+            while self._cached_bytes > self.cache_bytes and len(self._cache) > 1:
+                _, old = self._cache.popitem(last=False)
+                self._cached_bytes -= old.nbytes
+        return img
+
+    def _masked(self, piece):
+        crop = self.crop(piece)
+        x, y, _, _ = cv2.boundingRect(piece.contour)
+        mask = np.zeros(crop.shape[:2], np.uint8)
+        cv2.drawContours(mask, [np.asarray(piece.contour, dtype=np.int32) - [x, y]], -1, 255, cv2.FILLED)
+        bgra = cv2.cvtColor(np.ascontiguousarray(crop), cv2.COLOR_BGR2BGRA)
+        bgra[:, :, 3] = mask
+        return bgra
+
+    def _rotated(self, piece, angle):
+        img = self.masked(piece)
+        h, w = img.shape[:2]
+        M = cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1.0)
+        cos, sin = abs(M[0, 0]), abs(M[0, 1])
+        nw, nh = int(h * sin + w * cos + 0.5), int(h * cos + w * sin + 0.5)
+        M[0, 2] += nw / 2 - w / 2
+        M[1, 2] += nh / 2 - h / 2
+        return cv2.warpAffine(img, M, (nw, nh), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0, 0))
 
 class Piece:
-    def __init__(self, piece_id, contour, image, origin_offset=(0,0)):
+    __slots__ = ("id", "contour", "_image", "source", "origin", "sides", "corners", "rotation", "center", "store", "row")
+
+    def __init__(self, piece_id, contour, image, origin_offset=(0,0), source=None):
         """
         :param piece_id: Unique identifier for the piece
         :param contour: Full contour of the piece (in global coordinates or relative? usually relative to the cutout)
-        :param image: The cut-out image of the piece (RGBA or masked)
+        :param image: The cut-out image of the piece (RGBA or masked), or None to use source
         :param origin_offset: (x, y) offset of this piece's cutout from the original image
+        :param source: FrameSource the piece was detected in; image is then a lazy view of it
         """
         self.id = piece_id
         self.contour = contour
-        self.image = image
+        self._image = image
+        self.source = source
         self.origin = origin_offset
         self.sides = [None] * 4 # Top, Right, Bottom, Left (or indexed 0-3)
+        self.corners = None # Contour indices of the TL, TR, BR, BL corners, once analyzed
         self.rotation = 0 # 0, 90, 180, 270 (approximate)
         self.center = None # Centroid
+        self.store = None # PieceStore holding this piece's points, once packed
+        self.row = None # Index of this piece in its store
         
         # Calculate centroid if contour is provided
         if contour is not None and len(contour) > 0:
@@ -37,6 +205,140 @@ class Piece:
                 cY = int(M["m01"] / M["m00"])
                 self.center = (cX, cY)
 
+    @property
+    def image(self):
+        """The piece's cut-out image: a view of its source frame unless one was given."""
+        if self._image is None and self.source is not None:
+            return self.source.crop(self)
+        return self._image
+
+    @image.setter
+    def image(self, image):
+        self._image = image
+
+    def masked_image(self):
+        """BGRA cut-out, transparent outside the contour (cached by the source frame)."""
+        return self.source.masked(self)
+
+    def rotated_image(self, angle):
+        """masked_image rotated by angle degrees (cached by the source frame)."""
+        return self.source.rotated(self, angle)
+
     def set_side(self, index, side: Side):
         if 0 <= index < 4:
             self.sides[index] = side
+
+class PieceStore:
+    """
+    Struct-of-arrays storage for an analyzed piece set.
+    All contour points live in one contiguous int32 buffer (points) and every piece and side
+    is a [start, stop) range of it. Per-piece and per-side attributes are typed arrays.
+
+    Packing rebinds the contour of each piece and side to a view of the buffer, so Piece and
+    Side keep working as before. The store is a snapshot: sides set after packing are not in it.
+    """
+    def __init__(self, pieces: list[Piece]):
+        n = len(pieces)
+        self.pieces = list(pieces)
+        self.ids = np.array([p.id for p in pieces], dtype=np.int64)
+        self.origins = np.array([p.origin for p in pieces], dtype=np.int32).reshape(n, 2)
+        self.centers = np.array([p.center if p.center is not None else (np.nan, np.nan) for p in pieces],
+                                dtype=np.float64).reshape(n, 2) # NaN when the centroid is unknown
+        self.rotations = np.array([p.rotation for p in pieces], dtype=np.int16)
+        self.side_types = np.full((n, 4), -1, dtype=np.int8) # SideType value, -1 for no side
+        self.offsets = np.zeros(n + 1, dtype=np.int64) # Block of piece i: points[offsets[i]:offsets[i+1]]
+        self.contour_ranges = np.zeros((n, 2), dtype=np.int64) # [start, stop) of each contour
+        self.side_ranges = np.zeros((n, 4, 2), dtype=np.int64) # [start, stop) of each side
+
+        # Each piece's block is its contour, then the start of the contour again for sides
+        # that wrap past its end, then any sides that are not ranges of the contour
+        # (pieces whose sides were set without corner indices).
+        blocks = []
+        offset = 0
+        for row, piece in enumerate(pieces):
+            cnt = np.asarray(piece.contour).reshape(-1, 1, 2)
+            n_pts = len(cnt)
+            corners = piece.corners
+
+            wrap = 0
+            if corners is not None:
+                for i in range(4):
+                    a, b = corners[i], corners[(i+1)%4]
+                    if piece.sides[i] is not None and a >= b:
+                        wrap = max(wrap, b + 1)
+            parts = [cnt, cnt[:wrap]]
+            end = n_pts + wrap
+
+            for i, side in enumerate(piece.sides):
+                if side is None:
+                    continue
+                self.side_types[row, i] = side.type.value
+                if corners is not None:
+                    a, b = int(corners[i]), int(corners[(i+1)%4])
+                    rng = (a, b + 1) if a < b else (a, n_pts + b + 1)
+                else:
+                    parts.append(side.contour.reshape(-1, 1, 2))
+                    rng = (end, end + len(side.contour))
+                    end = rng[1]
+                self.side_ranges[row, i] = (offset + rng[0], offset + rng[1])
+
+            blocks.extend(parts)
+            self.contour_ranges[row] = (offset, offset + n_pts)
+            offset += end
+            self.offsets[row + 1] = offset
+
+        self.points = np.empty((offset, 1, 2), dtype=np.int32)
+        if blocks:
+            np.concatenate(blocks, axis=0, out=self.points, casting="unsafe")
+        self._bind()
+
+    @classmethod
+    def from_arrays(cls, pieces, ids, origins, centers, rotations, side_types, offsets, points,
+                    contour_ranges, side_ranges):
+        """
+        Store over arrays packed earlier (e.g. memory-mapped from a cache entry), without copying
+        them. The contours of the pieces and their sides are rebound to views of points.
+        """
+        store = cls.__new__(cls)
+        store.pieces = list(pieces)
+        store.ids = ids
+        store.origins = origins
+        store.centers = centers
+        store.rotations = rotations
+        store.side_types = side_types
+        store.offsets = offsets
+        store.points = points.reshape(-1, 1, 2)
+        store.contour_ranges = contour_ranges
+        store.side_ranges = side_ranges
+        store._bind()
+        return store
+
+    def _bind(self):
+        # Points each piece and side at its range of the buffer
+        for row, piece in enumerate(self.pieces):
+            start, stop = self.contour_ranges[row]
+            piece.contour = self.points[start:stop]
+            for i, side in enumerate(piece.sides):
+                if side is not None:
+                    start, stop = self.side_ranges[row, i]
+                    side.contour = self.points[start:stop]
+            piece.store = self
+            piece.row = row
+
+    def __len__(self):
+        return len(self.pieces)
+
+    def contour(self, row):
+        """Contour points of a piece, (N, 1, 2), relative to its origin."""
+        start, stop = self.contour_ranges[row]
+        return self.points[start:stop]
+
+    def side(self, row, index):
+        """Points of one side of a piece, (N, 1, 2), relative to the piece origin."""
+        start, stop = self.side_ranges[row, index]
+        return self.points[start:stop]
+
+    def global_points(self):
+        """The points buffer shifted by each piece's origin, i.e. in source image coordinates."""
+        block_lengths = np.diff(self.offsets)
+        return self.points + np.repeat(self.origins, block_lengths, axis=0)[:, None, :]
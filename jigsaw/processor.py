@@ -1,30 +1,251 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 import cv2
 import numpy as np
-from PySide6.QtGui import QImage, QPixmap
-from .piece import Piece
+from .piece import Piece, PieceStore, FrameSource
+from . import metrics
 
-def qpixmap_to_opencv(qpixmap: QPixmap) -> np.ndarray:
-    """Converts a QPixmap to an OpenCV image (BGR)."""
-    qimage = qpixmap.toImage()
-    qimage = qimage.convertToFormat(QImage.Format_RGB32)
-    
-    width = qimage.width()
-    height = qimage.height()
+def load_image(source) -> np.ndarray:
+    """
+    Returns a BGR image from a NumPy array (returned as is) or an image file path.
+    .npy files are memory-mapped rather than read into memory.
+    """
+    if isinstance(source, np.ndarray):
+        return source
+    if os.fspath(source).lower().endswith(".npy"):
+        return np.load(source, mmap_mode="r")
+    img = cv2.imread(os.fspath(source), cv2.IMREAD_COLOR)
+    if img is None:
+        raise FileNotFoundError(f"Could not read image: {source}")
+    return img
+
+TILE_SIZE = 1024 # Tile edge in pixels for tiled thresholding
+TILE_HALO = 8 # Overlap each side of a tile; covers the blur (2px) and closing (4px) radii
+TILED_MIN_PIXELS = 16_000_000 # Images larger than this are thresholded in tiles by default
+HISTOGRAM_STEP = 2 # Pyramid mode: the threshold histogram takes one pixel in HISTOGRAM_STEP^2
+BACKGROUND_SAMPLES = 1 << 14 # Pyramid mode: background pixels between the ROIs blurred for the histogram
+ROI_BATCH = 64 # Pyramid mode ROIs per thread pool task (each task costs ~0.1 ms on its own)
+
+def detect_pieces(image, min_area=500, tile_size=None, workers=None, downscale=1, analysis_workers=1):
+    """
+    Detects puzzle pieces assuming a solid background.
+    Returns a list of Piece objects.
+
+    :param image: BGR image as a NumPy array, or an image file path.
+                  jigsaw.qt.detect_pieces takes a QPixmap instead.
+
+    :param tile_size: Threshold the image in overlapping tiles of this size on a thread pool.
+                      0 processes the full frame at once; None tiles only large images.
+                      Both modes give the same mask.
+    :param workers: Threads used for tiles or ROI refinement (None lets the executor decide)
+    :param downscale: Pyramid mode when > 1 (e.g. 4 or 8): pieces are located at 1/downscale
+                      scale, then each contour is refined at full resolution within its ROI
+                      (grown until no contour is cut off at its edge). The threshold comes from
+                      a sample of the full resolution blurred frame, so in rare cases it may be
+                      a level off that of downscale=1. Pieces too small to be found at the
+                      coarse scale are missed. The returned mask is then the coarse one.
+    :param analysis_workers: Processes used by analyze_pieces (None for one per CPU)
+    """
+    img = load_image(image)
+    contours, thresh = find_piece_contours(img, min_area, tile_size, workers, downscale)
+    pieces = pieces_from_contours(img, contours, min_area)
+        
+    # Analyze shapes
+    analyze_pieces(pieces, analysis_workers)
+
+    # Pack all contours and sides into one buffer
+    PieceStore(pieces)
+        
+    return pieces, thresh # Return thresh for debugging visualization
+
+def pieces_from_contours(img, contours, min_area=500):
+    """
+    Unanalyzed Piece objects for the contours of at least min_area found in img.
+    Piece images are views of the frame, made when first used.
+    """
+    source = FrameSource(img)
     
-    ptr = qimage.bits()
-    arr = np.array(ptr).reshape(height, width, 4)  # Copies the data
+    pieces = []
+    piece_id = 1
     
-    # RGB32 is usually BGR order in OpenCV terms but check format
-    # QImage.Format_RGB32 is actually B G R A (0xAARRGGBB in little endian)
-    # So arr is BGRA. OpenCV uses BGR.
-    return arr[:, :, :3] # Drop Alpha
+    for cnt in contours:
+        area = cv2.contourArea(cnt)
+        if area < min_area:
+            continue
+            
+        x, y, w, h = cv2.boundingRect(cnt)
+        
+        # Adjust contour to be relative to the piece image (ROI)
+        cnt_shifted = cnt - [x, y]
+        
+        new_piece = Piece(piece_id, cnt_shifted, None, origin_offset=(x,y), source=source)
+        
+        pieces.append(new_piece)
+        piece_id += 1
+        
+    return pieces
 
-def detect_pieces(pixmap: QPixmap, min_area=500):
+def find_piece_contours(img, min_area=500, tile_size=None, workers=None, downscale=1):
     """
-    Detects puzzle pieces from a QPixmap assuming a solid background.
-    Returns a list of Piece objects.
+    External contours of the pieces in a BGR image, in full resolution image coordinates,
+    and the mask they were found in. See detect_pieces for the parameters.
+    """
+    if downscale > 1:
+        return _find_contours_pyramid(img, min_area, downscale, workers)
+    with metrics.timer("threshold"):
+        thresh = threshold_pieces(img, tile_size, workers)
+    with metrics.timer("find_contours"):
+        contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    return contours, thresh
+
+def _find_contours_pyramid(img, min_area, downscale, workers):
+    # Locate pieces on the downscaled image, then redo the threshold at full resolution only
+    # inside each piece's padded bounding rect, its ROI, grown until no contour it keeps is cut
+    # off at its edge. The threshold and polarity come from the blurred ROIs (every
+    # HISTOGRAM_STEP pixels) plus a sample of the background between them, blurred at full
+    # resolution: the frame is never blurred as a whole.
+    h, w = img.shape[:2]
+    # Plain decimation is a view of the frame; the blur in _otsu_mask smooths the aliasing
+    small = np.ascontiguousarray(img[::downscale, ::downscale])
+    with metrics.timer("threshold"):
+        coarse, _, _ = _otsu_mask(small)
+    with metrics.timer("find_contours"):
+        contours, _ = cv2.findContours(coarse, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    # Half the coarse area threshold, as the coarse outline is a little rough
+    contours = [c for c in contours if cv2.contourArea(c) * downscale ** 2 >= min_area / 2]
+    margin = 2 * downscale + TILE_HALO
+    kernel = np.ones((3,3), np.uint8)
+
+    # Coarse pixel -> 1 + index of the contour it lies in (0: none), to give every full
+    # resolution contour one owner by its centroid
+    labels = np.zeros(coarse.shape, np.int32)
+    for i, cnt in enumerate(contours):
+        cv2.drawContours(labels, [cnt], 0, i + 1, thickness=cv2.FILLED)
+
+    rois = []
+    for cnt in contours:
+        x, y, cw, ch = cv2.boundingRect(cnt)
+        rois.append((max(x * downscale - margin, 0), max(y * downscale - margin, 0),
+                     min((x + cw) * downscale + margin, w), min((y + ch) * downscale + margin, h)))
+
+    # Blurred frame every HISTOGRAM_STEP pixels, where an ROI has blurred it
+    step = HISTOGRAM_STEP
+    sampled = np.zeros((-(-h // step), -(-w // step)), np.uint8)
+    covered = np.zeros_like(sampled)
+
+    def blur(i):
+        x0, y0, x1, y1 = rois[i]
+        blurred, _ = _blur_tile(img, (y0, y1, x0, x1), (y0, y1, x0, x1))
+        # Sample only where the ROI blur is that of the full frame, away from the ROI edges
+        # inside the frame, so that overlapping ROIs write the same values
+        ay0, ay1 = y0 + 2 * (y0 > 0), y1 - 2 * (y1 < h)
+        ax0, ax1 = x0 + 2 * (x0 > 0), x1 - 2 * (x1 < w)
+        sy0, sx0 = -(-ay0 // step), -(-ax0 // step)
+        part = blurred[sy0 * step - y0:ay1 - y0:step, sx0 * step - x0:ax1 - x0:step]
+        sampled[sy0:sy0 + part.shape[0], sx0:sx0 + part.shape[1]] = part
+        covered[sy0:sy0 + part.shape[0], sx0:sx0 + part.shape[1]] = 255
+        return blurred
+
+    def refine(i, blurred):
+        x0, y0, x1, y1 = rois[i]
+        while True:
+            if blurred is None:
+                blurred, _ = _blur_tile(img, (y0, y1, x0, x1), (y0, y1, x0, x1))
+            _, thresh = cv2.threshold(blurred, t, 255, cv2.THRESH_BINARY_INV if invert else cv2.THRESH_BINARY)
+            blurred = None
+            with metrics.timer("morphology"):
+                thresh = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel, iterations=2)
+            with metrics.timer("find_contours"):
+                found, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+            # The ROI may clip neighbouring pieces, or hold several pieces that touched at the
+            # coarse scale. Keep the contours whose centroid falls in this coarse contour, and
+            # those whose centroid falls in none (orphans, which other ROIs may also find).
+            kept, clipped = [], []
+            for c in found:
+                M = cv2.moments(c)
+                if M["m00"] == 0:
+                    continue
+                cx = min(int((M["m10"] / M["m00"] + x0) / downscale), labels.shape[1] - 1)
+                cy = min(int((M["m01"] / M["m00"] + y0) / downscale), labels.shape[0] - 1)
+                owner = labels[cy, cx]
+                if owner not in (0, i + 1):
+                    continue
+                # Within TILE_HALO of an ROI edge inside the frame, the contour may be cut off
+                # or differ from the full frame one
+                bx, by, bw, bh = cv2.boundingRect(c)
+                if (x0 > 0 and bx < TILE_HALO) or (y0 > 0 and by < TILE_HALO) or \
+                   (x1 < w and bx + bw > x1 - x0 - TILE_HALO) or (y1 < h and by + bh > y1 - y0 - TILE_HALO):
+                    # Clipped specks of background texture are not worth growing the ROI for
+                    if owner or M["m00"] >= min_area / 2:
+                        clipped.append((bx, by, bw, bh))
+                else:
+                    kept.append(c + np.array([x0, y0], dtype=np.int32))
+            if not clipped:
+                return kept
+            # Grow the ROI on the sides the contours were clipped at, by at least half its size
+            metrics.count("roi_regrows")
+            gx, gy = max(margin, (x1 - x0) // 2), max(margin, (y1 - y0) // 2)
+            nx0, ny0, nx1, ny1 = x0, y0, x1, y1
+            for bx, by, bw, bh in clipped:
+                if bx < TILE_HALO:
+                    nx0 = max(x0 - gx, 0)
+                if by < TILE_HALO:
+                    ny0 = max(y0 - gy, 0)
+                if bx + bw > x1 - x0 - TILE_HALO:
+                    nx1 = min(x1 + gx, w)
+                if by + bh > y1 - y0 - TILE_HALO:
+                    ny1 = min(y1 + gy, h)
+            x0, y0, x1, y1 = nx0, ny0, nx1, ny1
+
+    # Thread pool tasks of ROI_BATCH ROIs, as there can be thousands of small ROIs
+    batches = [range(k, min(k + ROI_BATCH, len(rois))) for k in range(0, len(rois), ROI_BATCH)]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        with metrics.timer("threshold"):
+            blurred_rois = [b for batch in pool.map(lambda batch: [blur(i) for i in batch], batches) for b in batch]
+            hist = cv2.calcHist([sampled], [0], covered, [256], [0, 256]).ravel()
+            # Background between the ROIs: a strided sample of its grid pixels, standing for all of them
+            outside = covered.size - cv2.countNonZero(covered)
+            sample = np.arange(0, covered.size, max(covered.size // BACKGROUND_SAMPLES, 1))
+            sample = sample[covered.ravel()[sample] == 0]
+            if outside and len(sample):
+                values = _blurred_at(img, sample // covered.shape[1] * step, sample % covered.shape[1] * step)
+                hist += np.bincount(values, minlength=256) * (outside / len(sample))
+            t = otsu_threshold(hist)
+            invert = _inverted(_frame_corners(img), t)
+
+        def refine_batch(batch):
+            found = []
+            for i in batch:
+                blurred, blurred_rois[i] = blurred_rois[i], None
+                found.extend(refine(i, blurred))
+            return found
+
+        # Orphans are kept by every ROI that holds them whole, and are identical in each
+        refined = {}
+        for found in pool.map(refine_batch, batches):
+            for c in found:
+                refined.setdefault((cv2.boundingRect(c), len(c)), c)
+    return list(refined.values()), coarse
+
+def threshold_pieces(img, tile_size=None, workers=None):
+    """
+    Binary mask of the pieces in a BGR image: pieces white (255), background black (0).
+    See detect_pieces for tile_size and workers.
     """
-    img = qpixmap_to_opencv(pixmap)
+    h, w = img.shape[:2]
+    if tile_size is None:
+        tile_size = TILE_SIZE if h * w > TILED_MIN_PIXELS else 0
+    if tile_size <= 0 or (h <= tile_size and w <= tile_size):
+        return _threshold_frame(img)
+    return _threshold_tiled(img, tile_size, workers)
+
+def _threshold_frame(img):
+    return _otsu_mask(img)[0]
+
+def _otsu_mask(img):
+    # Full frame mask, plus the Otsu threshold and whether the mask was inverted
     gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
     
     # Blur to reduce noise
@@ -34,54 +255,185 @@ def detect_pieces(pixmap: QPixmap, min_area=500):
     # Assume background is either very dark or very light compared to pieces.
     # We can try OTSU or adaptive. User said "solid background".
     # Let's try Otsu first as it's robust for bimodal histograms.
-    _, thresh = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    t, thresh = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
     
     # Invert if the background is detected as white (pieces are black)
     # Usually we want pieces to be white (255) and background black (0) for findContours
     # Simple check: if corners are white, inverted.
     h, w = thresh.shape
     corners = [thresh[0,0], thresh[0, w-1], thresh[h-1, 0], thresh[h-1, w-1]]
-    if sum(corners) / 4 > 127: 
+    invert = sum(corners) / 4 > 127
+    if invert: 
         thresh = cv2.bitwise_not(thresh)
         
     # Morphological operations to close gaps
     kernel = np.ones((3,3), np.uint8)
-    thresh = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel, iterations=2)
-    
-    contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    
-    pieces = []
-    piece_id = 1
-    
-    for cnt in contours:
-        area = cv2.contourArea(cnt)
-        if area < min_area:
+    with metrics.timer("morphology"):
+        thresh = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel, iterations=2)
+    return thresh, t, invert
+
+def _tiles(h, w, tile_size, halo):
+    # (inner, outer) slices per tile: inner is the area the tile owns, outer adds the halo
+    for y0 in range(0, h, tile_size):
+        for x0 in range(0, w, tile_size):
+            y1, x1 = min(y0 + tile_size, h), min(x0 + tile_size, w)
+            oy0, ox0 = max(y0 - halo, 0), max(x0 - halo, 0)
+            oy1, ox1 = min(y1 + halo, h), min(x1 + halo, w)
+            yield (y0, y1, x0, x1), (oy0, oy1, ox0, ox1)
+
+def _blur_tile(img, inner, outer):
+    # Blurred gray tile (with halo) and the offsets of the inner area within it
+    oy0, oy1, ox0, ox1 = outer
+    y0, y1, x0, x1 = inner
+    gray = cv2.cvtColor(img[oy0:oy1, ox0:ox1], cv2.COLOR_BGR2GRAY)
+    blurred = cv2.GaussianBlur(gray, (5, 5), 0)
+    return blurred, (y0 - oy0, y1 - oy0, x0 - ox0, x1 - ox0)
+
+def otsu_threshold(hist):
+    """Otsu threshold of a 256-bin histogram, computed as cv2.THRESH_OTSU does."""
+    hist = np.asarray(hist, dtype=np.float64)
+    p = hist / hist.sum()
+    mu = np.dot(np.arange(256), p)
+    eps = np.finfo(np.float32).eps
+    mu1 = q1 = max_sigma = 0.0
+    best = 0
+    for i in range(256):
+        mu1 *= q1
+        q1 += p[i]
+        q2 = 1.0 - q1
+        if min(q1, q2) < eps or max(q1, q2) > 1.0 - eps:
             continue
-            
-        x, y, w, h = cv2.boundingRect(cnt)
-        
-        # Extract the piece image (ROI)
-        piece_img = img[y:y+h, x:x+w].copy()
-        
-        # Adjust contour to be relative to the piece_img
-        cnt_shifted = cnt - [x, y]
-        
-        new_piece = Piece(piece_id, cnt_shifted, piece_img, origin_offset=(x,y))
-        
-        # Analyze shape
-        analyze_piece(new_piece)
-        
-        pieces.append(new_piece)
-        piece_id += 1
-        
-    return pieces, thresh # Return thresh for debugging visualization
+        mu1 = (mu1 + i * p[i]) / q1
+        mu2 = (mu - q1 * mu1) / q2
+        sigma = q1 * q2 * (mu1 - mu2) ** 2
+        if sigma > max_sigma:
+            max_sigma = sigma
+            best = i
+    return best
+
+def _tile_histogram(img, inner, outer, corner_px):
+    # Blurred tile (with halo), the histogram of the part it owns and the blurred values of
+    # the corner_px (y, x) frame pixels in that part
+    blurred, (iy0, iy1, ix0, ix1) = _blur_tile(img, inner, outer)
+    owned = blurred[iy0:iy1, ix0:ix1]
+    hist = cv2.calcHist([owned], [0], None, [256], [0, 256]).ravel()
+    y0, y1, x0, x1 = inner
+    corners = {(y, x): owned[y - y0, x - x0] for y, x in corner_px if y0 <= y < y1 and x0 <= x < x1}
+    return blurred, hist, corners
+
+def _corner_pixels(h, w):
+    return [(0, 0), (0, w - 1), (h - 1, 0), (h - 1, w - 1)]
+
+def _frame_corners(img):
+    # Blurred values of the four frame corners, as the full frame blur gives them
+    h, w = img.shape[:2]
+    corners = {}
+    for y, x in _corner_pixels(h, w):
+        outer = (max(y - TILE_HALO, 0), min(y + TILE_HALO + 1, h), max(x - TILE_HALO, 0), min(x + TILE_HALO + 1, w))
+        corners.update(_tile_histogram(img, (y, y + 1, x, x + 1), outer, [(y, x)])[2])
+    return corners
+
+def _blurred_at(img, ys, xs):
+    # Blurred gray values of the frame at pixels (ys, xs), as _blur_tile gives them (up to
+    # rounding, and with the border replicated), without blurring the whole frame
+    h, w = img.shape[:2]
+    k = cv2.getGaussianKernel(5, 0).ravel()
+    offsets = np.arange(-2, 3)
+    yy = np.clip(ys[:, None, None] + offsets[None, :, None], 0, h - 1)
+    xx = np.clip(xs[:, None, None] + offsets[None, None, :], 0, w - 1)
+    gray = np.rint(img[yy, xx] @ np.array([0.114, 0.587, 0.299])) # BGR to gray, as cv2.cvtColor
+    return np.rint(np.einsum("nij,i,j->n", gray, k, k)).astype(np.int64)
+
+def _inverted(blurred_corners, t):
+    # Whether the background is white: cv2.threshold keeps values above t, and the mask is
+    # inverted when most frame corners are white, as in _otsu_mask
+    return sum(255 if value > t else 0 for value in blurred_corners.values()) / 4 > 127
+
+def _threshold_tiled(img, tile_size, workers):
+    # Same result as _threshold_frame. Each tile is processed with a halo wide enough for the
+    # blur and closing, so tiles agree with the full frame and the mask stitches seamlessly.
+    # Only the blurred tiles and the output mask add up to full size (one byte per pixel each);
+    # the gray and thresholded copies exist per tile only.
+    h, w = img.shape[:2]
+    tiles = list(_tiles(h, w, tile_size, TILE_HALO))
+    corner_px = _corner_pixels(h, w)
+
+    def histogram(tile):
+        return _tile_histogram(img, *tile, corner_px)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # Pass 1: global Otsu threshold from the summed tile histograms
+        hist = np.zeros(256)
+        blurred_tiles = []
+        blurred_corners = {}
+        for blurred, tile_hist, corners in pool.map(histogram, tiles):
+            blurred_tiles.append(blurred)
+            hist += tile_hist
+            blurred_corners.update(corners)
+        t = otsu_threshold(hist)
+
+        # Invert if the background is detected as white (corners are white)
+        invert = _inverted(blurred_corners, t)
+
+        mask = np.empty((h, w), np.uint8)
+        kernel = np.ones((3,3), np.uint8)
+
+        # Pass 2: threshold and close each tile, keep the part it owns
+        def close(k):
+            inner, outer = tiles[k]
+            blurred = blurred_tiles[k]
+            blurred_tiles[k] = None
+            iy0, iy1 = inner[0] - outer[0], inner[1] - outer[0]
+            ix0, ix1 = inner[2] - outer[2], inner[3] - outer[2]
+            _, thresh = cv2.threshold(blurred, t, 255, cv2.THRESH_BINARY_INV if invert else cv2.THRESH_BINARY)
+            with metrics.timer("morphology"):
+                thresh = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel, iterations=2)
+            y0, y1, x0, x1 = inner
+            mask[y0:y1, x0:x1] = thresh[iy0:iy1, ix0:ix1]
+
+        list(pool.map(close, range(len(tiles))))
+
+    return mask
+
+PARALLEL_MIN_PIECES = 500 # Fewer pieces than this are analyzed serially
 
 def analyze_piece(piece: Piece):
     """
     Analyzes the piece contour to identify 4 sides and their types.
     Updates the piece.sides list.
     """
-    cnt = piece.contour
+    _set_sides(piece, analyze_contour(piece.contour))
+
+def analyze_pieces(pieces: list[Piece], workers=1):
+    """
+    analyze_piece for a whole piece set. Only the contours are sent to the worker processes,
+    and the sides are built from the returned corner indices and side types.
+
+    :param workers: Number of worker processes (None for one per CPU). Sets with fewer than
+                    PARALLEL_MIN_PIECES pieces are always analyzed serially.
+    """
+    workers = workers or os.cpu_count() or 1
+    contours = [piece.contour for piece in pieces]
+    with metrics.timer("analyze"):
+        if workers > 1 and len(pieces) >= PARALLEL_MIN_PIECES:
+            chunksize = max(1, len(pieces) // (workers * 4))
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(analyze_contour, contours, chunksize=chunksize))
+        else:
+            results = list(map(analyze_contour, contours))
+
+        for piece, result in zip(pieces, results):
+            _set_sides(piece, result)
+    metrics.count("pieces_analyzed", len(pieces))
+    metrics.count("pieces_without_corners", sum(result is None for result in results))
+
+def analyze_contour(cnt):
+    """
+    Finds the 4 corners of a piece contour and classifies the sides between them.
+    Returns (corner_indices, side_types) with the indices into cnt of the TL, TR, BR, BL
+    corners and the SideType value of sides 0-3 (TL->TR, TR->BR, BR->BL, BL->TL),
+    or None if the contour does not simplify to 4 corners.
+    """
     epsilon = 0.04 * cv2.arcLength(cnt, True)
     approx = cv2.approxPolyDP(cnt, epsilon, True)
     
@@ -92,12 +444,8 @@ def analyze_piece(piece: Piece):
         # Let's try to enforce 4 corners by finding convex hull or just taking extreme points
         # But for this task, let's assume approxPolyDP works reasonably well for standard pieces
         # If it detects > 4, maybe we can pick the strongest corners?
-        # A simple fallback:
-        if len(approx) > 4:
-            # Sort by distance between points or just pick 4?
-            # Or re-approximate with larger epsilon
-            pass
-        return 
+        # Or re-approximate with larger epsilon
+        return None
         
     # Order points: Top-Left, Top-Right, Bottom-Right, Bottom-Left
     # Standard trick: sum(x+y) for TL/BR, diff(y-x) for TR/BL
@@ -112,65 +460,38 @@ def analyze_piece(piece: Piece):
     rect[1] = points[np.argmin(diff)] # TR
     rect[3] = points[np.argmax(diff)] # BL
     
-    # Now extract the full contour segments between these corners
-    # We need to find the index of these corners in the original contour
+    # Now find the index of these corners in the original contour:
+    # the closest contour point to each corner, all 4 in one distance pass.
+    # contour is (N, 1, 2), rect is (4, 2) -> distances (N, 4)
+    dists = np.sum((cnt[:, :, :] - rect[None, :, :])**2, axis=2)
+    indices = np.argmin(dists, axis=0)
     
-    # Helper to find closest point index
-    def find_index(pt, contour):
-        # pt is [x, y]
-        # contour is (N, 1, 2)
-        dists = np.sum((contour[:, 0, :] - pt)**2, axis=1)
-        return np.argmin(dists)
-        
-    indices = [find_index(pt, cnt) for pt in rect]
-    
-    # Re-order indices to be sequential (considering wrap-around)
-    # The rect extraction does not guarantee order along contour, so let's sort indices?
-    # Actually, contour order matters. 
-    # Let's re-sort rect based on their appearance in the contour to respect continuous path?
-    # No, we want logical sides (Top, Right, Bottom, Left). 
-    # So we need to walk from TL -> TR (Top), TR -> BR (Right), etc.
-    
-    # But contour might be clockwise or counter-clockwise.
-    # Check orientation?
-    # Assuming standard orientation of contour, let's just use the logic:
-    # Top is roughly min-y line?
-    
-    # Let's trust the TL, TR, BR, BL logic for "sides" mapping.
+    # We want logical sides (Top, Right, Bottom, Left), so we walk the contour
+    # from TL -> TR (Top), TR -> BR (Right), etc.
+    # Assuming standard orientation of contour:
     # Side 0: TL to TR
     # Side 1: TR to BR
     # Side 2: BR to BL
     # Side 3: BL to TL
     
-    from .piece import Side, SideType
+    from .piece import SideType
     
+    types = np.zeros(4, dtype=np.int8)
     for i in range(4):
         p1_idx = indices[i]
         p2_idx = indices[(i+1)%4]
-        
-        # Extract segment
-        if p1_idx < p2_idx:
-            segment = cnt[p1_idx:p2_idx+1]
-        else: # Wrap around
-            segment = np.vstack((cnt[p1_idx:], cnt[:p2_idx+1]))
+        segment = side_segment(cnt, p1_idx, p2_idx)
             
         # Classify Side
         # Check max deviation from line connecting endpoints
         p1 = cnt[p1_idx][0]
         p2 = cnt[p2_idx][0]
         
-        # Line equation or distance
-        # Simple method: Check center of mass of segment vs line
-        # Or peak distance.
-        
-        # Convert segment to points and rotate so line p1-p2 is X-axis?
-        # Simpler: signed distance of point from line.
-        
         if len(segment) < 5:
             # Too short, probably flat
             s_type = SideType.FLAT
         else:
-            # Calculate distances of all points in segment to line p1-p2
+            # Calculate signed distances of all points in segment to line p1-p2
             # Vector p1->p2
             vec = p2 - p1
             # Normal vector (-y, x)
@@ -208,6 +529,30 @@ def analyze_piece(piece: Piece):
                 s_type = SideType.SOCKET
             else:
                 s_type = SideType.FLAT
+
+        types[i] = s_type.value
                 
-        piece.set_side(i, Side(segment, s_type))
+    return indices, types
+
+def side_segment(cnt, p1_idx, p2_idx):
+    """
+    Contour points walking forward from index p1_idx to p2_idx (inclusive), wrapping around
+    the end of the closed contour. A view of cnt unless the walk wraps.
+    """
+    if p1_idx < p2_idx:
+        return cnt[p1_idx:p2_idx+1]
+    # Wrap around: index arithmetic instead of stacking the two slices
+    n = len(cnt)
+    return cnt.take(np.arange(p1_idx, p2_idx + n + 1), axis=0, mode="wrap")
+
+def _set_sides(piece: Piece, result):
+    # Builds the piece's sides from an analyze_contour result
+    if result is None:
+        return
+    from .piece import Side, SideType, SideDescriptor
 
+    indices, types = result
+    piece.corners = indices
+    for i in range(4):
+        segment = side_segment(piece.contour, indices[i], indices[(i+1)%4])
+        piece.set_side(i, Side(segment, SideType(int(types[i])), SideDescriptor(segment)))
@@ -0,0 +1,35 @@
+import numpy as np
+from PySide6.QtGui import QImage, QPixmap
+from . import processor, metrics
+
+# Thin Qt adapter over jigsaw.processor, which itself only needs NumPy and OpenCV.
+
+class _QImageBuffer:
+    """Exposes the pixels of a QImage to NumPy and keeps the QImage alive while they are viewed."""
+    def __init__(self, qimage: QImage):
+        self.qimage = qimage
+        data = np.frombuffer(qimage.constBits(), np.uint8)
+        self.__array_interface__ = {
+            "version": 3,
+            "shape": (qimage.height(), qimage.width(), 4),
+            "typestr": "|u1",
+            "data": (data.ctypes.data, True), # Read-only
+            "strides": (qimage.bytesPerLine(), 4, 1),
+        }
+
+def qimage_to_opencv(qimage: QImage) -> np.ndarray:
+    """Read-only BGR view of a QImage (no pixel copy if it is already RGB32)."""
+    # QImage.Format_RGB32 is actually B G R A (0xAARRGGBB in little endian)
+    # So the buffer is BGRA. OpenCV uses BGR.
+    with metrics.timer("to_opencv"):
+        qimage = qimage.convertToFormat(QImage.Format_RGB32)
+        arr = np.asarray(_QImageBuffer(qimage))
+    return arr[:, :, :3] # Drop Alpha
+
+def qpixmap_to_opencv(qpixmap: QPixmap) -> np.ndarray:
+    """Converts a QPixmap to an OpenCV image (BGR), viewing the QImage buffer without copying it."""
+    return qimage_to_opencv(qpixmap.toImage())
+
+def detect_pieces(pixmap: QPixmap, **kwargs):
+    """jigsaw.processor.detect_pieces for a QPixmap."""
+    return processor.detect_pieces(qpixmap_to_opencv(pixmap), **kwargs)
@@ -10,6 +10,7 @@ def main():
     parser.add_argument("-bi", "--box-image", help="Path to the box cover image", type=str)
     parser.add_argument("-ji", "--jigsaw-image", help="Path to the currently assembled jigsaw image", type=str)
     parser.add_argument("-pi", "--piece-image", help="Path to the remaining unplaced pieces image", type=str)
+    parser.add_argument("--opengl", help="Render the work area through OpenGL", action="store_true")
     
     # We need to handle QApp args vs our args. 
     # Usually PySide6 handles its own args, but argparse might conflict if not careful.
@@ -29,15 +30,18 @@ def main():
     args, unknown = parser.parse_known_args()
     
     window = MainWindow()
+
+    if args.opengl and not window.work_image.set_opengl():
+        print("OpenGL is not available, using the default renderer.")
+    window.show()
     
+    # The images are decoded concurrently in the background, showing placeholders until then
     if args.box_image:
         window.load_box_cover(args.box_image)
     if args.jigsaw_image:
         window.load_jigsaw_image(args.jigsaw_image)
     if args.piece_image:
         window.load_piece_image(args.piece_image)
-
-    window.show()
     
     sys.exit(app.exec())
 
@@ -1,5 +1,5 @@
 
-from PySide6.QtWidgets import QWidget, QVBoxLayout, QPushButton, QLabel
+from PySide6.QtWidgets import QWidget, QVBoxLayout, QPushButton, QLabel, QProgressBar, QSlider, QSpinBox
 from PySide6.QtCore import Qt
 
 class ControlPanel(QWidget):
@@ -35,6 +35,81 @@ class ControlPanel(QWidget):
         self.btn_process_pieces = QPushButton("Process Pieces")
         self.btn_process_pieces.setVisible(False)
         layout.addWidget(self.btn_process_pieces)
-        
+
+        # Progress of a Process Pieces run, shown while it is running
+        self.progress_label = QLabel()
+        self.progress_label.setVisible(False)
+        layout.addWidget(self.progress_label)
+
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setVisible(False)
+        layout.addWidget(self.progress_bar)
+
+        self.btn_cancel_processing = QPushButton("Cancel")
+        self.btn_cancel_processing.setVisible(False)
+        layout.addWidget(self.btn_cancel_processing)
+
+        # Stage timers and counters of the last run (jigsaw.metrics)
+        self.stats_label = QLabel()
+        self.stats_label.setStyleSheet("font-family: monospace; font-size: 11px; color: #aaa;")
+        self.stats_label.setVisible(False)
+        layout.addWidget(self.stats_label)
+
+        # Match line filter, shown once there are matches
+        self.match_score_label = QLabel()
+        layout.addWidget(self.match_score_label)
+
+        self.match_score_slider = QSlider(Qt.Horizontal)
+        self.match_score_slider.setRange(1, 100) # Percent of the worst displayed score
+        self.match_score_slider.setValue(100)
+        layout.addWidget(self.match_score_slider)
+
+        self.match_top_n = QSpinBox()
+        self.match_top_n.setRange(0, 1000000)
+        self.match_top_n.setSpecialValueText("All matches")
+        self.match_top_n.setPrefix("Top ")
+        layout.addWidget(self.match_top_n)
+
+        self.match_score_slider.valueChanged.connect(self.update_match_filter)
+        self.match_top_n.valueChanged.connect(self.update_match_filter)
+        self.update_match_filter()
+        self.hide_match_filter()
+
         # Expand filler to push items up
         layout.addStretch()
+
+    def show_progress(self, stage, done, total):
+        self.progress_label.setText(f"{stage.capitalize()}: {done}" + (f" / {total}" if total else ""))
+        # A zero maximum shows a busy indicator when the total is unknown
+        self.progress_bar.setMaximum(total)
+        self.progress_bar.setValue(done)
+        for w in (self.progress_label, self.progress_bar, self.btn_cancel_processing):
+            w.setVisible(True)
+
+    def hide_progress(self):
+        for w in (self.progress_label, self.progress_bar, self.btn_cancel_processing):
+            w.setVisible(False)
+
+    def show_stats(self, snapshot):
+        # snapshot as returned by jigsaw.metrics.Metrics.snapshot()
+        lines = []
+        timers = sorted(snapshot["timers"].items(), key=lambda item: -item[1]["seconds"])
+        for name, timer in timers:
+            lines.append(f"{name:<22}{timer['seconds']:>8.3f}s  x{timer['calls']}")
+        for name, n in sorted(snapshot["counters"].items()):
+            lines.append(f"{name:<22}{n:>9}")
+        self.stats_label.setText("\n".join(lines))
+        self.stats_label.setVisible(bool(lines))
+
+    def update_match_filter(self):
+        score = self.match_score_slider.value()
+        self.match_score_label.setText(f"Match score ≤ {score}% of worst")
+        self.graphics_area.set_match_filter(score / 100, self.match_top_n.value())
+
+    def show_match_filter(self):
+        for w in (self.match_score_label, self.match_score_slider, self.match_top_n):
+            w.setVisible(True)
+
+    def hide_match_filter(self):
+        for w in (self.match_score_label, self.match_score_slider, self.match_top_n):
+            w.setVisible(False)
@@ -1,7 +1,11 @@
 
-from PySide6.QtWidgets import QGraphicsView, QGraphicsScene, QGraphicsRectItem, QGraphicsPixmapItem, QGraphicsEllipseItem, QGraphicsPolygonItem
-from PySide6.QtCore import Qt, QPointF
-from PySide6.QtGui import QPainter, QBrush, QColor, QPen, QPolygonF
+import math
+import numpy as np
+from PySide6.QtWidgets import QGraphicsView, QGraphicsScene, QGraphicsRectItem, QGraphicsPixmapItem, QGraphicsEllipseItem, QGraphicsPolygonItem, QGraphicsItem, QStyleOptionGraphicsItem
+from PySide6.QtCore import Qt, QPointF, QRectF, QByteArray, QDataStream, QIODevice, QThreadPool
+from PySide6.QtGui import QPainter, QBrush, QColor, QPen, QPolygonF, QPainterPath
+from jigsaw import metrics
+from .tiled_image import TiledImageItem, PyramidWorker, TILED_MIN_PIXELS
 
 class HandleItem(QGraphicsEllipseItem):
     def __init__(self, x, y, radius=30, parent_selector=None):
@@ -19,6 +23,143 @@ class HandleItem(QGraphicsEllipseItem):
             self.parent_selector.update_polygon()
         return super().itemChange(change, value)
 
+LOD_LEVELS = 6 # Level 0 is full detail, level k > 0 is simplified to 2^(k-1) scene px
+
+def painter_path(points, starts):
+    """
+    QPainterPath of polylines built in bulk from NumPy: points is (N, 2) in scene coordinates
+    and starts holds the index where each polyline begins. The path is read from a
+    QDataStream buffer (Qt's QPainterPath serialization) instead of one point at a time.
+    """
+    n = len(points)
+    if n == 0:
+        return QPainterPath()
+    elements = np.empty(n, dtype=[("type", ">i4"), ("x", ">f8"), ("y", ">f8")])
+    elements["type"] = 1 # LineToElement
+    elements["type"][starts] = 0 # MoveToElement
+    elements["x"] = points[:, 0]
+    elements["y"] = points[:, 1]
+    # Element count, elements, start of the last subpath, fill rule
+    data = QByteArray(np.array([n], ">i4").tobytes() + elements.tobytes()
+                      + np.array([starts[-1], int(Qt.OddEvenFill.value)], ">i4").tobytes())
+    path = QPainterPath()
+    stream = QDataStream(data, QIODevice.ReadOnly)
+    stream >> path
+    return path
+
+def lod_level(lod):
+    """Simplification level that stays within half a screen pixel at the given level of detail."""
+    tolerance = 0.5 / lod if lod > 0 else float("inf")
+    if tolerance < 1:
+        return 0
+    return min(LOD_LEVELS - 1, int(math.log2(tolerance)) + 1)
+
+class LodPathItem(QGraphicsItem):
+    """
+    One scene item drawing many polylines (e.g. all sides of one type) with a single pen.
+    When zoomed out it draws a simplified copy, built the first time a level is needed.
+    """
+    def __init__(self, polylines, pen, parent=None):
+        super().__init__(parent)
+        self.polylines = [p for p in polylines if len(p) >= 2]
+        self.pen = pen
+        self._paths = {}
+
+        if self.polylines:
+            pts = np.concatenate(self.polylines)
+            (x0, y0), (x1, y1) = pts.min(axis=0), pts.max(axis=0)
+        else:
+            x0 = y0 = x1 = y1 = 0.0
+        m = pen.widthF()
+        self._rect = QRectF(x0 - m, y0 - m, x1 - x0 + 2 * m, y1 - y0 + 2 * m)
+
+    def boundingRect(self):
+        return self._rect
+
+    def path_at(self, level):
+        if level not in self._paths:
+            polylines = self.polylines
+            if level > 0:
+                import cv2
+                eps = 2.0 ** (level - 1)
+                polylines = [cv2.approxPolyDP(p.astype(np.float32).reshape(-1, 1, 2), eps, False).reshape(-1, 2)
+                             for p in polylines]
+            if polylines:
+                starts = np.cumsum([0] + [len(p) for p in polylines[:-1]])
+                self._paths[level] = painter_path(np.concatenate(polylines), starts)
+            else:
+                self._paths[level] = QPainterPath()
+        return self._paths[level]
+
+    def paint(self, painter, option, widget=None):
+        lod = QStyleOptionGraphicsItem.levelOfDetailFromTransform(painter.worldTransform())
+        with metrics.timer("paint"):
+            painter.setPen(self.pen)
+            painter.setBrush(Qt.NoBrush)
+            painter.drawPath(self.path_at(lod_level(lod)))
+
+class MatchLinesItem(QGraphicsItem):
+    """
+    One scene item drawing all match lines. Lines are kept sorted by score so a score
+    threshold / top-N filter is a prefix of them, and only lines crossing the exposed
+    area are drawn.
+    """
+    def __init__(self, pen, parent=None):
+        super().__init__(parent)
+        self.pen = pen
+        self.lines = np.zeros((0, 2, 2)) # (M, start/end, x/y), ascending score
+        self.scores = np.zeros(0)
+        self.score_fraction = 1.0
+        self.top_n = 0
+        self._rect = QRectF()
+        # exposedRect is only filled in with this flag
+        self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption)
+
+    def add_lines(self, lines, scores):
+        if not len(lines):
+            return
+        lines = np.concatenate((self.lines, lines))
+        scores = np.concatenate((self.scores, np.asarray(scores, dtype=np.float64)))
+        order = np.argsort(scores, kind="stable")
+        self.lines, self.scores = lines[order], scores[order]
+
+        self.prepareGeometryChange()
+        pts = self.lines.reshape(-1, 2)
+        (x0, y0), (x1, y1) = pts.min(axis=0), pts.max(axis=0)
+        m = self.pen.widthF()
+        self._rect = QRectF(x0 - m, y0 - m, x1 - x0 + 2 * m, y1 - y0 + 2 * m)
+
+    def set_filter(self, score_fraction=1.0, top_n=0):
+        self.score_fraction = score_fraction
+        self.top_n = top_n
+        self.update()
+
+    def visible_count(self):
+        """Number of lines (from the best score on) that pass the filter."""
+        if not len(self.scores):
+            return 0
+        count = int(np.searchsorted(self.scores, self.scores[-1] * self.score_fraction, side="right"))
+        return min(count, self.top_n) if self.top_n > 0 else count
+
+    def boundingRect(self):
+        return self._rect
+
+    def paint(self, painter, option, widget=None):
+        lines = self.lines[:self.visible_count()]
+        if not len(lines):
+            return
+        # Cull lines whose bounding box misses the exposed area
+        r = option.exposedRect
+        lo, hi = lines.min(axis=1), lines.max(axis=1)
+        keep = ((hi[:, 0] >= r.left()) & (lo[:, 0] <= r.right())
+                & (hi[:, 1] >= r.top()) & (lo[:, 1] <= r.bottom()))
+        lines = lines[keep]
+        if not len(lines):
+            return
+        with metrics.timer("paint"):
+            painter.setPen(self.pen)
+            painter.drawPath(painter_path(lines.reshape(-1, 2), np.arange(0, 2 * len(lines), 2)))
+
 class GraphicsArea(QGraphicsView):
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -33,6 +174,28 @@ class GraphicsArea(QGraphicsView):
         
         # Visual style
         self.setBackgroundBrush(QBrush(QColor(30, 30, 30))) # Dark background
+
+        self.match_item = None # All match lines, see display_matches
+        self.match_filter = (1.0, 0) # Score fraction, top N
+        self.side_midpoints = {} # Side -> scene position of its center
+        self.image_item = None # TiledImageItem of a large image
+        self.pyramid_worker = None # Builds the levels of image_item
+
+    def set_opengl(self, enabled=True):
+        """
+        Renders the scene through an OpenGL viewport (or back to the default raster one).
+        Returns False if Qt's OpenGL widgets are not available.
+        """
+        if enabled:
+            try:
+                from PySide6.QtOpenGLWidgets import QOpenGLWidget
+            except ImportError:
+                return False
+            self.setViewport(QOpenGLWidget())
+        else:
+            from PySide6.QtWidgets import QWidget
+            self.setViewport(QWidget())
+        return True
         
     def add_rect(self):
         # Add a movable rectangle to the center
@@ -55,16 +218,35 @@ class GraphicsArea(QGraphicsView):
         self.scene.addItem(rect)
         
     def clear_scene(self):
+        if self.pyramid_worker:
+            self.pyramid_worker.cancel()
+            self.pyramid_worker.signals.level_ready.disconnect()
+            self.pyramid_worker = None
+        self.image_item = None
         self.scene.clear()
+        self.match_item = None
+        self.side_midpoints.clear()
 
     def display_image(self, pixmap):
         self.clear_scene()
-        item = QGraphicsPixmapItem(pixmap)
-        item.setTransformationMode(Qt.SmoothTransformation)
+        if pixmap.width() * pixmap.height() >= TILED_MIN_PIXELS:
+            # Tiles from a pyramid whose coarser levels are built in the background
+            image = pixmap.toImage()
+            item = self.image_item = TiledImageItem(image)
+            self.pyramid_worker = PyramidWorker(image)
+            self.pyramid_worker.signals.level_ready.connect(self.on_image_level_ready)
+            QThreadPool.globalInstance().start(self.pyramid_worker)
+        else:
+            item = QGraphicsPixmapItem(pixmap)
+            item.setTransformationMode(Qt.SmoothTransformation)
         self.scene.addItem(item)
         self.scene.setSceneRect(item.boundingRect())
         self.fitInView(item, Qt.KeepAspectRatio)
 
+    def on_image_level_ready(self, level, image):
+        if self.image_item is not None:
+            self.image_item.add_level(level, image)
+
     def start_parallax_mode(self):
         # Create a large transparent rectangle (polygon) in the center with 4 handles
         # We need to base coordinates on current scene rect
@@ -122,94 +304,76 @@ class GraphicsArea(QGraphicsView):
     def display_pieces_contours(self, pieces):
         # We assume the background image is already displayed or cleared.
         # This overlays contours.
-        
-        pen = QPen(QColor("magenta"), 2)
-        
-        for piece in pieces:
-            # content is contour points
-            # cv2 contour is (N, 1, 2) array of (x,y)
-            # Need to convert to QPolygonF
-            # Also piece.contour is relative to the piece cutout? 
-            # In processor.py: new_piece = Piece(..., cnt_shifted, ...) with origin_offset
-            # So to draw on main image, we need to shift back or usage global contour?
-            
-            # processor.py line 73: cnt_shifted = cnt - [x, y]
-            # piece.origin = (x, y)
-            
-            # So global_pos = pt + origin
-            
-            # Draw full contour first as base
-            base_poly = QPolygonF()
-            ox, oy = piece.origin
-            for pt in piece.contour:
-                px, py = pt[0]
-                base_poly.append(QPointF(px + ox, py + oy))
-            
-            base_item = QGraphicsPolygonItem(base_poly)
-            # base_item.setPen(QPen(QColor(100, 100, 100), 1))
-            base_item.setPen(Qt.NoPen)
+        # All outlines go into one item and all sides of a type into another, built in bulk.
+
+        # piece.contour is relative to the piece cutout, piece.origin = (x, y) of the cutout
+        # So global_pos = pt + origin
+        from jigsaw.piece import SideType
+        colors = {
+            SideType.FLAT: QColor("green"),
+            SideType.TAB: QColor("red"),
+            SideType.SOCKET: QColor("blue")
+        }
+
+        with metrics.timer("render_pieces"):
+            outlines = []
+            sides = {side_type: [] for side_type in colors}
+            for piece in pieces:
+                origin = np.asarray(piece.origin, dtype=np.float64)
+                cnt = piece.contour[:, 0, :] + origin
+                outlines.append(np.vstack((cnt, cnt[:1]))) # Closed
+                for side in piece.sides:
+                    if side and side.contour is not None:
+                        sides[side.type].append(side.contour[:, 0, :] + origin)
+
+            # Full contours first as base
+            base_item = LodPathItem(outlines, QPen(Qt.NoPen))
             # base_item.setBrush(QBrush(QColor(255, 255, 255, 30))) # Slight fill
             self.scene.addItem(base_item)
-            
-            # Draw Sides with colors
-            from jigsaw.piece import SideType
-            colors = {
-                SideType.FLAT: QColor("green"),
-                SideType.TAB: QColor("red"),
-                SideType.SOCKET: QColor("blue")
-            }
-            
-            for side in piece.sides:
-                if side and side.contour is not None:
-                    path = QPainterPath()
-                    start_pt = side.contour[0][0]
-                    path.moveTo(start_pt[0] + ox, start_pt[1] + oy)
-                    
-                    for i in range(1, len(side.contour)):
-                        pt = side.contour[i][0]
-                        path.lineTo(pt[0] + ox, pt[1] + oy)
-                    
-                    path_item = QGraphicsPathItem(path)
-                    pen = QPen(colors.get(side.type, QColor("white")), 3)
-                    path_item.setPen(pen)
-                    self.scene.addItem(path_item)
 
+            # Sides with colors
+            for side_type, polylines in sides.items():
+                if polylines:
+                    self.scene.addItem(LodPathItem(polylines, QPen(colors[side_type], 3)))
 
     def display_matches(self, matches):
         """
         Draws lines connecting matched sides.
         matches: list of dicts with 'p1', 's1', 'p2', 's2', 'score'
+        Can be called repeatedly; all lines are kept by one MatchLinesItem.
         """
-        pen = QPen(QColor("yellow"), 2, Qt.DashLine)
-        
-        for m in matches:
-            p1 = m['p1']
-            p2 = m['p2']
-            s1 = m['s1'] # index
-            s2 = m['s2'] # index
-            
-            # Get center points of the sides
-            # Side 1
-            side1 = p1.sides[s1]
-            if not side1 or side1.contour is None: continue
-            
-            # Simple average of points
-            # contour is (N, 1, 2)
-            c1 = np.mean(side1.contour, axis=0)[0]
-            # Add origin offset
-            start_pt = QPointF(c1[0] + p1.origin[0], c1[1] + p1.origin[1])
-            
-            # Side 2
-            side2 = p2.sides[s2]
-            if not side2 or side2.contour is None: continue
-            c2 = np.mean(side2.contour, axis=0)[0]
-            end_pt = QPointF(c2[0] + p2.origin[0], c2[1] + p2.origin[1])
-            
-            line = QGraphicsPathItem()
-            path = QPainterPath()
-            path.moveTo(start_pt)
-            path.lineTo(end_pt)
-            
-            line.setPath(path)
-            line.setPen(pen)
-            self.scene.addItem(line)
+        with metrics.timer("render_matches"):
+            if self.match_item is None:
+                self.match_item = MatchLinesItem(QPen(QColor("yellow"), 2, Qt.DashLine))
+                self.match_item.set_filter(*self.match_filter)
+                self.scene.addItem(self.match_item)
+
+            lines = []
+            scores = []
+            for m in matches:
+                start_pt = self.side_midpoint(m['p1'], m['s1'])
+                end_pt = self.side_midpoint(m['p2'], m['s2'])
+                if start_pt is None or end_pt is None: continue
+                lines.append((start_pt, end_pt))
+                scores.append(m['score'])
+            self.match_item.add_lines(np.array(lines, dtype=np.float64).reshape(-1, 2, 2), scores)
+
+    def side_midpoint(self, piece, side_idx):
+        """Scene position of the center of a side, or None if the side is unknown (cached)."""
+        side = piece.sides[side_idx]
+        if not side or side.contour is None:
+            return None
+        if side not in self.side_midpoints:
+            # Simple average of points, contour is (N, 1, 2)
+            c = np.mean(side.contour, axis=0)[0]
+            self.side_midpoints[side] = (c[0] + piece.origin[0], c[1] + piece.origin[1])
+        return self.side_midpoints[side]
+
+    def set_match_filter(self, score_fraction=1.0, top_n=0):
+        """
+        Shows only the matches scoring at most score_fraction of the worst displayed score,
+        and of those at most the top_n best (0 for all). Nothing is rebuilt.
+        """
+        self.match_filter = (score_fraction, top_n)
+        if self.match_item is not None:
+            self.match_item.set_filter(score_fraction, top_n)
@@ -0,0 +1,29 @@
+from PySide6.QtCore import QObject, QRunnable, Signal
+from PySide6.QtGui import QImage, QImageReader
+from .thumbnail_worker import make_thumbnail
+
+class ImageLoadWorkerSignals(QObject):
+    loaded = Signal(object, QImage, QImage) # Key given to the worker, image, thumbnail
+    failed = Signal(object, str) # Key given to the worker, error message
+
+class ImageLoadWorker(QRunnable):
+    """
+    Decodes an image file and makes its preview thumbnail off the GUI thread, so that
+    several images load concurrently on the thread pool.
+    """
+    def __init__(self, key, file_path):
+        super().__init__()
+        self.key = key
+        self.file_path = file_path
+        self.signals = ImageLoadWorkerSignals()
+
+    def run(self):
+        from jigsaw import metrics
+        reader = QImageReader(self.file_path)
+        reader.setAutoTransform(True) # Like QPixmap(file_path)
+        with metrics.timer("decode"):
+            image = reader.read()
+        if image.isNull():
+            self.signals.failed.emit(self.key, reader.errorString())
+            return
+        self.signals.loaded.emit(self.key, image, make_thumbnail(image))
@@ -1,21 +1,33 @@
 
 from PySide6.QtWidgets import QMainWindow, QWidget, QHBoxLayout, QVBoxLayout, QLabel, QMenu, QFileDialog, QDialog, QPushButton
 from PySide6.QtGui import QAction, QColor, QPalette, QPixmap, QImage
-import cv2
-import numpy as np
-from PySide6.QtCore import Qt, Signal, QPoint
+from PySide6.QtCore import Qt, Signal, QPoint, QThreadPool, QTimer
 from .graphics_area import GraphicsArea
 from .controls import ControlPanel
 from .parallax_worker import ParallaxHelpDialog, apply_parallax_correction
+from .piece_worker import PieceWorker
+from .thumbnail_worker import ThumbnailWorker
+from .image_loader import ImageLoadWorker
+
+RESIZE_DEBOUNCE_MS = 150 # Smooth rescale of the previews once resizing has paused this long
 
 class ImageLabel(QLabel):
     clicked = Signal(QPixmap)
+    image_loaded = Signal(QPixmap)
 
     def __init__(self, text):
         super().__init__(text)
         self.setAlignment(Qt.AlignCenter)
         self.setStyleSheet("background-color: #333; border: 1px dashed #555; color: #888; font-size: 16px;")
         self._original_pixmap = None
+        self._thumbnail = None # Smaller copy of the original that serves the resizes
+        self._load_key = 0 # Identifies the load / thumbnail worker of the current image
+
+        # Resizes are drawn with a fast scale at once and a smooth one when they settle
+        self._resize_timer = QTimer(self)
+        self._resize_timer.setSingleShot(True)
+        self._resize_timer.setInterval(RESIZE_DEBOUNCE_MS)
+        self._resize_timer.timeout.connect(self.update_display)
 
     def contextMenuEvent(self, event):
         menu = QMenu(self)
@@ -34,23 +46,66 @@ class ImageLabel(QLabel):
         if file_name:
             self.set_image(file_name)
 
-    def set_image(self, file_path):
-        pixmap = QPixmap(file_path)
-        if not pixmap.isNull():
-            self._original_pixmap = pixmap
-            self.update_display()
-            self.setStyleSheet("background-color: #333; border: none;")
+    def set_image(self, image):
+        """Shows a QPixmap, or an image file which is decoded in the background."""
+        self._load_key += 1
+        if isinstance(image, QPixmap):
+            self.set_pixmap(image)
+            return
+        if not self._original_pixmap:
+            self.setText("Loading...")
+        worker = ImageLoadWorker(self._load_key, image)
+        worker.signals.loaded.connect(self.on_image_loaded)
+        worker.signals.failed.connect(self.on_image_failed)
+        QThreadPool.globalInstance().start(worker)
+
+    def set_pixmap(self, pixmap, thumbnail=None):
+        if pixmap.isNull():
+            return
+        self._original_pixmap = pixmap
+        self._thumbnail = thumbnail
+        if thumbnail is None:
+            worker = ThumbnailWorker(self._load_key, pixmap.toImage())
+            worker.signals.finished.connect(self.on_thumbnail_ready)
+            QThreadPool.globalInstance().start(worker)
+        self.update_display(Qt.SmoothTransformation if thumbnail else Qt.FastTransformation)
+        self.setStyleSheet("background-color: #333; border: none;")
+
+    def on_image_loaded(self, key, image, thumbnail):
+        if key != self._load_key:
+            return # Replaced in the meantime
+        self.set_pixmap(QPixmap.fromImage(image), QPixmap.fromImage(thumbnail))
+        self.image_loaded.emit(self._original_pixmap)
+
+    def on_image_failed(self, key, message):
+        if key != self._load_key:
+            return
+        print(f"Could not load image: {message}")
+        if not self._original_pixmap:
+            self.setText("Could not load image")
+
+    def on_thumbnail_ready(self, key, image):
+        if key != self._load_key:
+            return # Thumbnail of an image replaced in the meantime
+        self._thumbnail = QPixmap.fromImage(image)
+        self.update_display()
 
     def resizeEvent(self, event):
         if self._original_pixmap:
-            self.update_display()
+            self.update_display(Qt.FastTransformation)
+            self._resize_timer.start()
         super().resizeEvent(event)
 
-    def update_display(self):
+    def update_display(self, mode=Qt.SmoothTransformation):
         if not self._original_pixmap:
             return
-        # Scale to current size, keep aspect ratio
-        scaled = self._original_pixmap.scaled(self.size(), Qt.KeepAspectRatio, Qt.SmoothTransformation)
+        # Scale to current size, keep aspect ratio, from the thumbnail when it is big enough
+        source = self._original_pixmap
+        target = source.size().scaled(self.size(), Qt.KeepAspectRatio)
+        if self._thumbnail and (mode == Qt.FastTransformation or self._thumbnail.width() >= target.width()):
+            # While resizing it may be upscaled a little, until the smooth scale of the original
+            source = self._thumbnail
+        scaled = source.scaled(self.size(), Qt.KeepAspectRatio, mode)
         self.setPixmap(scaled)
 
 
@@ -73,8 +128,12 @@ class MainWindow(QMainWindow):
         self.controls = ControlPanel(self.work_image)
         self.controls.btn_fix_parallax.clicked.connect(self.start_parallax_flow)
         self.controls.btn_process_pieces.clicked.connect(self.start_piece_detection)
+        self.controls.btn_cancel_processing.clicked.connect(self.cancel_piece_detection)
 
         self.current_source_label = None
+        self.activate_on_load = None # Label made active once its image has loaded
+        self.piece_worker = None
+        self.stopping_worker = None # Cancelled worker that has not exited yet
 
         # --- Right Side Content Area (Vertical: Top Images | Bottom Graphics) ---
         content_widget = QWidget()
@@ -94,6 +153,7 @@ class MainWindow(QMainWindow):
         for text in labels:
             label = ImageLabel(text)
             label.clicked.connect(lambda p, s=text: self.set_active_image(p, s))
+            label.image_loaded.connect(lambda p, s=text: self.on_image_loaded(p, s))
             self.image_labels[text] = label
             top_row_layout.addWidget(label)
 
@@ -130,8 +190,14 @@ class MainWindow(QMainWindow):
     def load_box_cover(self, file_path):
         if "Box cover" in self.image_labels:
             self.image_labels["Box cover"].set_image(file_path)
-            # Optionally simulate a click to make it active immediately
-            self.set_active_image(self.image_labels["Box cover"]._original_pixmap, "Box cover")
+            # Optionally simulate a click to make it active once it is loaded
+            self.activate_on_load = "Box cover"
+
+    def on_image_loaded(self, pixmap, source_label):
+        self.update_stats() # Decode time
+        if source_label == self.activate_on_load:
+            self.activate_on_load = None
+            self.set_active_image(pixmap, source_label)
 
     def load_jigsaw_image(self, file_path):
         if "So far" in self.image_labels:
@@ -142,10 +208,14 @@ class MainWindow(QMainWindow):
             self.image_labels["Pieces"].set_image(file_path)
 
     def set_active_image(self, pixmap, source_label):
+        # Results of a running Process Pieces belong to the previous image
+        self.cancel_piece_detection()
+        self.activate_on_load = None # The user's choice wins over a pending load
         self.current_source_label = source_label
         self.current_pixmap = pixmap
         print(f"Active source set to: {self.current_source_label}") # Verification/Debug
         self.work_image.display_image(pixmap)
+        self.controls.hide_match_filter()
 
         if self.current_source_label == "Box cover":
             self.controls.btn_fix_parallax.setVisible(True)
@@ -226,20 +296,73 @@ class MainWindow(QMainWindow):
         if not hasattr(self, 'current_pixmap') or not self.current_pixmap:
             return
 
+        if self.piece_worker or self.stopping_worker:
+            return
+
         print("Starting piece detection...")
-        from jigsaw.processor import detect_pieces
 
-        # Run detection
-        pieces, thresh_img = detect_pieces(self.current_pixmap)
+        # Run detection, analysis and matching on the thread pool; results are drawn as they arrive
+        from jigsaw import metrics
+        metrics.METRICS.reset()
+
+        worker = PieceWorker(self.current_pixmap.toImage())
+        worker.signals.progress.connect(self.controls.show_progress)
+        worker.signals.progress.connect(self.update_stats)
+        worker.signals.pieces_found.connect(self.work_image.display_pieces_contours)
+        worker.signals.matches_found.connect(self.work_image.display_matches)
+        worker.signals.matches_found.connect(self.controls.show_match_filter)
+        worker.signals.finished.connect(self.on_piece_detection_finished)
+        worker.signals.cancelled.connect(self.on_piece_detection_stopped)
+        worker.signals.failed.connect(self.on_piece_detection_failed)
+
+        self.piece_worker = worker
+        self.controls.btn_process_pieces.setEnabled(False)
+        QThreadPool.globalInstance().start(worker)
+
+    def cancel_piece_detection(self):
+        if self.piece_worker:
+            worker = self.piece_worker
+            worker.cancel()
+            # Ignore anything it still sends, e.g. partial results already queued
+            signals = worker.signals
+            for signal in (signals.progress, signals.pieces_found, signals.matches_found,
+                           signals.finished, signals.cancelled, signals.failed):
+                signal.disconnect()
+            # Process Pieces stays disabled until the worker has exited, so that two runs never
+            # overlap (they would share the metrics)
+            self.stopping_worker = worker
+            signals.exited.connect(lambda: self.on_stopping_worker_exited(worker))
+            if worker.has_exited(): # Exited before the connection was made
+                self.on_stopping_worker_exited(worker)
+            self.on_piece_detection_stopped()
+
+    def on_stopping_worker_exited(self, worker):
+        if self.stopping_worker is worker:
+            self.stopping_worker = None
+            self.controls.btn_process_pieces.setEnabled(self.piece_worker is None)
+
+    def on_piece_detection_finished(self, pieces, matches):
         print(f"Detected {len(pieces)} pieces.")
-
-
-        # Visualize
-        self.work_image.display_pieces_contours(pieces)
-
-        from jigsaw.matcher import find_matches
-        matches = find_matches(pieces)
         print(f"Found {len(matches)} potential matches.")
-
-        self.work_image.display_matches(matches)
+        self.on_piece_detection_stopped()
+
+        from jigsaw import metrics
+        sink = metrics.sink_from_env()
+        if sink:
+            sink.write({"source": self.current_source_label, "pieces": len(pieces), "matches": len(matches),
+                        **metrics.METRICS.snapshot()})
+
+    def update_stats(self, *args):
+        from jigsaw import metrics
+        self.controls.show_stats(metrics.METRICS.snapshot())
+
+    def on_piece_detection_failed(self, message):
+        print(f"Piece detection failed: {message}")
+        self.on_piece_detection_stopped()
+
+    def on_piece_detection_stopped(self):
+        self.piece_worker = None
+        self.controls.hide_progress()
+        self.update_stats()
+        self.controls.btn_process_pieces.setEnabled(self.stopping_worker is None)
 
@@ -1,8 +1,6 @@
 
 from PySide6.QtWidgets import QDialog, QVBoxLayout, QLabel, QPushButton
 from PySide6.QtGui import QImage, QPixmap
-import cv2
-import numpy as np
 
 class ParallaxHelpDialog(QDialog):
     def __init__(self, parent=None):
@@ -28,6 +26,10 @@ def apply_parallax_correction(current_pixmap, coords):
     if not coords or len(coords) != 4 or not current_pixmap:
         return None
 
+    # Imported here so that starting the app does not have to wait for OpenCV
+    import cv2
+    import numpy as np
+
     # 1. Prepare Source Points
     src_pts = np.array([(p.x(), p.y()) for p in coords], dtype=np.float32)
 
@@ -0,0 +1,123 @@
+import os
+import threading
+from PySide6.QtCore import QObject, QRunnable, Signal
+from PySide6.QtGui import QImage
+
+ANALYSIS_BATCH = 50 # Pieces analyzed (and drawn) per progress step
+MATCH_BATCH = 200 # Matches collected before they are sent to the GUI
+
+class PieceWorkerSignals(QObject):
+    progress = Signal(str, int, int) # Stage ("detect", "analyse", "match"), done, total
+    pieces_found = Signal(object) # A list of analyzed pieces
+    matches_found = Signal(object) # A list of matches
+    finished = Signal(object, object) # All pieces, all matches
+    cancelled = Signal()
+    failed = Signal(str)
+    exited = Signal() # Always sent last, whichever way the run ended
+
+class PieceWorker(QRunnable):
+    """
+    Runs piece detection, analysis and matching off the GUI thread (on a QThreadPool).
+    Partial results are emitted as they become available, and cancel() stops the run
+    at the next batch boundary.
+    """
+    def __init__(self, qimage: QImage):
+        super().__init__()
+        # QImage, not QPixmap: pixmaps may only be used on the GUI thread
+        self.qimage = qimage
+        self.signals = PieceWorkerSignals()
+        self._cancel = threading.Event()
+        self._exited = threading.Event()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def is_cancelled(self):
+        return self._cancel.is_set()
+
+    def has_exited(self):
+        return self._exited.is_set()
+
+    def run(self):
+        try:
+            self._run()
+        finally:
+            self._exited.set()
+            self.signals.exited.emit()
+
+    def _run(self):
+        from jigsaw import metrics
+        try:
+            # Opt-in cProfile of the whole run, see jigsaw.metrics.PROFILE_ENV
+            with metrics.profiled(os.environ.get(metrics.PROFILE_ENV)):
+                result = self._process()
+        except Exception as e:
+            self.signals.failed.emit(str(e))
+            return
+        if result is None:
+            self.signals.cancelled.emit()
+        else:
+            self.signals.finished.emit(*result)
+
+    def _process(self):
+        from jigsaw.qt import qimage_to_opencv
+        from jigsaw.processor import find_piece_contours, pieces_from_contours, analyze_pieces
+        from jigsaw.piece import PieceStore
+        from jigsaw.matcher import iter_matches, match_settings, STREAM_TOP_K
+        from jigsaw.cache import ResultCache, cache_key
+
+        signals = self.signals
+
+        signals.progress.emit("detect", 0, 1)
+        img = qimage_to_opencv(self.qimage)
+
+        # Results of an image processed before come from the on-disk cache
+        cache = ResultCache()
+        key = cache_key(img, {"pipeline": "piece_worker", "min_area": 500, "top_k": STREAM_TOP_K, **match_settings()})
+        cached = cache.load(key, img)
+        if cached is not None:
+            pieces, matches = cached
+            signals.pieces_found.emit(pieces)
+            signals.matches_found.emit(matches)
+            signals.progress.emit("match", len(matches), len(matches))
+            return pieces, matches
+
+        contours, _ = find_piece_contours(img)
+        pieces = pieces_from_contours(img, contours)
+        signals.progress.emit("detect", 1, 1)
+        if self.is_cancelled():
+            return None
+
+        for start in range(0, len(pieces), ANALYSIS_BATCH):
+            batch = pieces[start:start + ANALYSIS_BATCH]
+            analyze_pieces(batch)
+            signals.pieces_found.emit(batch)
+            signals.progress.emit("analyse", start + len(batch), len(pieces))
+            if self.is_cancelled():
+                return None
+        PieceStore(pieces)
+
+        # The number of matches is not known up front, so report found matches and no total
+        matches = []
+        batch = []
+        for match in iter_matches(pieces, cancelled=self.is_cancelled):
+            batch.append(match)
+            if len(batch) >= MATCH_BATCH:
+                matches.extend(batch)
+                signals.matches_found.emit(batch)
+                signals.progress.emit("match", len(matches), 0)
+                batch = []
+            if self.is_cancelled():
+                return None
+        if self.is_cancelled():
+            return None
+        if batch:
+            matches.extend(batch)
+            signals.matches_found.emit(batch)
+        signals.progress.emit("match", len(matches), len(matches))
+
+        try:
+            cache.store(key, pieces, matches)
+        except OSError as e:
+            print(f"Could not cache the results: {e}")
+        return pieces, matches
@@ -0,0 +1,25 @@
+from PySide6.QtCore import Qt, QObject, QRunnable, Signal
+from PySide6.QtGui import QImage
+
+THUMBNAIL_SIZE = 1024 # Longer edge of the preview thumbnails
+
+class ThumbnailWorkerSignals(QObject):
+    finished = Signal(object, QImage) # Key given to the worker, thumbnail
+
+class ThumbnailWorker(QRunnable):
+    """Smooth-scales an image down to a preview thumbnail off the GUI thread."""
+    def __init__(self, key, image: QImage, size=THUMBNAIL_SIZE):
+        super().__init__()
+        self.key = key
+        # QImage, not QPixmap: pixmaps may only be used on the GUI thread
+        self.image = image
+        self.size = size
+        self.signals = ThumbnailWorkerSignals()
+
+    def run(self):
+        self.signals.finished.emit(self.key, make_thumbnail(self.image, self.size))
+
+def make_thumbnail(image: QImage, size=THUMBNAIL_SIZE) -> QImage:
+    if max(image.width(), image.height()) > size:
+        image = image.scaled(size, size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+    return image
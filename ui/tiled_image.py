@@ -0,0 +1,100 @@
+import math
+import threading
+from collections import OrderedDict
+from PySide6.QtWidgets import QGraphicsItem, QStyleOptionGraphicsItem
+from PySide6.QtCore import Qt, QObject, QRunnable, QRect, QRectF, Signal
+from PySide6.QtGui import QImage, QPixmap, QPainter
+from jigsaw import metrics
+
+TILE_SIZE = 512 # Tile edge in pixels of its pyramid level
+MIN_LEVEL_SIZE = 256 # Stop halving once the longer edge of a level is this small
+TILE_CACHE = 256 # Tile pixmaps kept, least recently drawn are dropped (~256 MB at 512 px)
+TILED_MIN_PIXELS = 4e6 # Smaller images are shown as one plain pixmap
+
+class PyramidWorkerSignals(QObject):
+    level_ready = Signal(int, QImage) # Level, image at 1 / 2^level of the full size
+
+class PyramidWorker(QRunnable):
+    """Builds the downsampled levels of an image off the GUI thread, each from the previous one."""
+    def __init__(self, image: QImage):
+        super().__init__()
+        self.image = image
+        self.signals = PyramidWorkerSignals()
+        self._cancel = threading.Event()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def run(self):
+        image = self.image
+        level = 0
+        while max(image.width(), image.height()) > MIN_LEVEL_SIZE and not self._cancel.is_set():
+            image = image.scaled((image.width() + 1) // 2, (image.height() + 1) // 2,
+                                 Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+            level += 1
+            self.signals.level_ready.emit(level, image)
+
+class TiledImageItem(QGraphicsItem):
+    """
+    Image item for very large images. It keeps a pyramid of downsampled levels and paints
+    only the tiles in the exposed area, from the coarsest level still sharper than the screen.
+    Levels other than the full image are added with add_level as they are built.
+    """
+    def __init__(self, image: QImage, parent=None):
+        super().__init__(parent)
+        self.levels = {0: image}
+        self._rect = QRectF(0, 0, image.width(), image.height())
+        self._tiles = OrderedDict() # (level, tx, ty) -> QPixmap
+        self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption)
+
+    def add_level(self, level, image):
+        self.levels[level] = image
+        self.update()
+
+    def boundingRect(self):
+        return self._rect
+
+    def level_for(self, lod):
+        """Coarsest built level with at least one image pixel per screen pixel."""
+        wanted = int(math.floor(math.log2(1 / lod))) if 0 < lod < 1 else 0
+        return max(level for level in self.levels if level <= wanted)
+
+    def tile(self, level, tx, ty):
+        key = (level, tx, ty)
+        pixmap = self._tiles.get(key)
+        if pixmap is None:
+            image = self.levels[level]
+            # Edge tiles keep their real size: copy() would pad them with black past the image
+            rect = QRect(tx * TILE_SIZE, ty * TILE_SIZE, TILE_SIZE, TILE_SIZE).intersected(image.rect())
+            pixmap = QPixmap.fromImage(image.copy(rect))
+            self._tiles[key] = pixmap
+            if len(self._tiles) > TILE_CACHE:
+                self._tiles.popitem(last=False)
+        else:
+            self._tiles.move_to_end(key)
+        return pixmap
+
+    def paint(self, painter, option, widget=None):
+        lod = QStyleOptionGraphicsItem.levelOfDetailFromTransform(painter.worldTransform())
+        level = self.level_for(lod)
+        image = self.levels[level]
+        # Scene units per level pixel (levels are rounded up, so not exactly 2^level)
+        sx = self._rect.width() / image.width()
+        sy = self._rect.height() / image.height()
+
+        r = option.exposedRect.intersected(self._rect)
+        if r.isEmpty():
+            return
+        tx0, tx1 = int(r.left() / sx) // TILE_SIZE, int(math.ceil(r.right() / sx)) // TILE_SIZE
+        ty0, ty1 = int(r.top() / sy) // TILE_SIZE, int(math.ceil(r.bottom() / sy)) // TILE_SIZE
+        tx1 = min(tx1, (image.width() - 1) // TILE_SIZE)
+        ty1 = min(ty1, (image.height() - 1) // TILE_SIZE)
+
+        painter.setRenderHint(QPainter.SmoothPixmapTransform)
+        with metrics.timer("paint"):
+            for ty in range(ty0, ty1 + 1):
+                for tx in range(tx0, tx1 + 1):
+                    pixmap = self.tile(level, tx, ty)
+                    target = QRectF(tx * TILE_SIZE * sx, ty * TILE_SIZE * sy,
+                                    pixmap.width() * sx, pixmap.height() * sy)
+                    painter.drawPixmap(target, pixmap, QRectF(pixmap.rect()))